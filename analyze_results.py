@@ -0,0 +1,22 @@
+import argparse
+
+from models.analytics import EvalTable
+
+"""
+
+    prints all metrics of the paper's tables (FIT-SQL, TDEX, ExA, classification
+    and response accuracy, per-type scores, confusion matrices) for the given
+    datasets and models, every eval file is loaded only once
+
+"""
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--datasets", type=str, nargs="+", choices=["spider", "bird"], default=["spider", "bird"])
+    parser.add_argument("--models", type=str, nargs="+", choices=["gpt-5", "gemini-2.5-pro", "qwen-3-80B", "llama-3.3-70B"],
+                        default=["gpt-5", "gemini-2.5-pro", "qwen-3-80B", "llama-3.3-70B"])
+    args = parser.parse_args()
+
+    table = EvalTable(datasets=args.datasets, models=args.models)
+    table.report()
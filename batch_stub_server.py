@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from models.llm import LLM, TOOL_NAME
+from models.batch import BatchRunner
+from models.response_cache import ResponseCache
+
+"""
+
+    local stand-in for the OpenAI files, batches and chat completions endpoints
+    every request is answered with the same tool call, batches complete after a few polls
+
+    serve it and point prompt_model.py to it:
+        python batch_stub_server.py --port 8000
+        python prompt_model.py --model gpt-5 --mode batch --base-url http://127.0.0.1:8000/v1 --poll-interval 1
+
+    or run a full BatchRunner cycle against it (upload, create, poll, download,
+    resume from the state file and cache hits):
+        python batch_stub_server.py --check
+
+"""
+
+ANSWER = {"type": "sql", "sql": "SELECT 1", "message": ""}
+POLLS_UNTIL_DONE = 2 # status checks answered with in_progress before a batch completes
+
+
+def chat_completion(body:dict, request_id:str):
+
+    # minimal chat completion that models.llm parses like a real one
+    prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in body.get("messages", []))
+    return {
+        "id": f"chatcmpl-{request_id}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{
+            "index": 0,
+            "finish_reason": "tool_calls",
+            "message": {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call-{request_id}",
+                    "type": "function",
+                    "function": {"name": TOOL_NAME, "arguments": json.dumps(ANSWER)}
+                }]
+            }
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": 10,
+            "total_tokens": prompt_tokens + 10,
+            "prompt_tokens_details": {"cached_tokens": 0}
+        }
+    }
+
+
+class StubState:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {} # file id -> {"meta": file object, "content": bytes}
+        self.batches = {} # batch id -> batch object
+        self.polls = {} # batch id -> status checks so far
+        self.chat_requests = 0
+
+    def add_file(self, content:bytes, filename:str, purpose:str):
+        with self.lock:
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = {
+                "meta": {
+                    "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                    "filename": filename, "purpose": purpose, "status": "processed"
+                },
+                "content": content
+            }
+            return self.files[file_id]["meta"]
+
+    def add_batch(self, body:dict):
+        with self.lock:
+            batch_id = f"batch-{len(self.batches) + 1}"
+            lines = [line for line in self.files[body["input_file_id"]]["content"].splitlines() if line.strip()]
+            self.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": body["endpoint"],
+                "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+                "status": "validating", "created_at": int(time.time()),
+                "output_file_id": None, "error_file_id": None,
+                "request_counts": {"total": len(lines), "completed": 0, "failed": 0}
+            }
+            self.polls[batch_id] = 0
+            return self.batches[batch_id]
+
+    def retrieve_batch(self, batch_id:str):
+
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch["status"] == "completed":
+                return batch
+
+            self.polls[batch_id] += 1
+            if self.polls[batch_id] < POLLS_UNTIL_DONE:
+                batch["status"] = "in_progress"
+                return batch
+
+        # answer every input line and store the output file
+        output = []
+        for line in self.files[batch["input_file_id"]]["content"].splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            request_id = f"{batch_id}-{request['custom_id']}"
+            output.append(json.dumps({
+                "id": request_id,
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": request_id, "body": chat_completion(request["body"], request_id)},
+                "error": None
+            }))
+
+        output_file = self.add_file(("\n".join(output) + "\n").encode("utf-8"), f"{batch_id}_output.jsonl", "batch_output")
+        with self.lock:
+            batch["status"] = "completed"
+            batch["output_file_id"] = output_file["id"]
+            batch["request_counts"]["completed"] = len(output)
+            return batch
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    state = None # set by make_server
+
+    def log_message(self, format, *args):
+        pass # keep the console for the client's output
+
+    def _path(self):
+        path = self.path.split("?")[0]
+        return path[len("/v1"):] if path.startswith("/v1/") else path
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _send(self, status:int, payload, content_type:str="application/json"):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+
+        path = self._path()
+        body = self._body()
+
+        if path == "/files":
+            # multipart form with the fields file and purpose
+            message = BytesParser(policy=email_policy).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body
+            )
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            file_part = fields["file"]
+            purpose = fields["purpose"].get_payload(decode=True).decode("utf-8")
+            self._send(200, self.state.add_file(file_part.get_payload(decode=True), file_part.get_filename(), purpose))
+        elif path == "/batches":
+            self._send(200, self.state.add_batch(json.loads(body)))
+        elif path == "/chat/completions":
+            with self.state.lock:
+                self.state.chat_requests += 1
+                request_id = str(self.state.chat_requests)
+            self._send(200, chat_completion(json.loads(body), request_id))
+        else:
+            self._send(404, {"error": {"message": f"Unknown endpoint {path}"}})
+
+    def do_GET(self):
+
+        path = self._path()
+        parts = path.strip("/").split("/")
+
+        if len(parts) == 2 and parts[0] == "batches" and parts[1] in self.state.batches:
+            self._send(200, self.state.retrieve_batch(parts[1]))
+        elif len(parts) == 3 and parts[0] == "files" and parts[2] == "content" and parts[1] in self.state.files:
+            self._send(200, self.state.files[parts[1]]["content"], content_type="application/octet-stream")
+        else:
+            self._send(404, {"error": {"message": f"Unknown endpoint {path}"}})
+
+
+def make_server(host:str="127.0.0.1", port:int=8000):
+
+    handler = type("Handler", (StubHandler,), {"state": StubState()})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def check():
+
+    # one BatchRunner cycle per case against a stub server on a free port
+    server = make_server(port=0)
+    state = server.RequestHandlerClass.state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    os.environ.setdefault("OPENAI_API_KEY", "stub") # never sent anywhere else
+    requests = [(i, [{"role": "user", "content": f"question {i}"}], "stub") for i in range(5)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        llm = LLM(provider="openai", model="gpt-5", base_url=base_url, cache=ResponseCache(path=f"{tmp}/responses.sqlite"))
+        runner = BatchRunner(llm, input_path=f"{tmp}/input.jsonl", output_path=f"{tmp}/output.jsonl",
+                             state_path=f"{tmp}/state.json", poll_interval=0)
+
+        # interrupted after submitting: the next run polls the same batch instead of submitting again
+        runner.write_input(requests[:3])
+        runner.submit()
+        responses = runner.run(requests[:3])
+        assert len(state.batches) == 1, "resumed run submitted a new batch"
+        assert sorted(responses) == ["0", "1", "2"]
+        assert all(r["response"] == ANSWER for r in responses.values())
+        assert not os.path.exists(runner.state_path)
+        print("resume from state file: ok")
+
+        # cached requests are served locally, only the misses are submitted
+        responses = runner.run(requests)
+        assert len(state.batches) == 2
+        assert state.batches["batch-2"]["request_counts"]["total"] == 2
+        assert sorted(responses) == ["0", "1", "2", "3", "4"]
+        print("cache hits skipped in the batch input: ok")
+
+        # everything cached, nothing is submitted
+        responses = runner.run(requests)
+        assert len(state.batches) == 2 and len(responses) == 5
+        print("fully cached run submits nothing: ok")
+
+        # online requests go through the chat completions endpoint
+        result = LLM(provider="openai", model="gpt-5", base_url=base_url).ask([{"role": "user", "content": "online"}])
+        assert result["response"] == ANSWER and state.chat_requests == 1
+        print("chat completion: ok")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--check", action="store_true", help="run a batch cycle against the stub and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+    else:
+        server = make_server(args.host, args.port)
+        print(f"Serving stub endpoints on http://{args.host}:{args.port}/v1")
+        server.serve_forever()
@@ -3,6 +3,7 @@
 SCHEMAS_PATH = "data/schemas/" # holds prepared schemas once generated
 QUESTIONS_PATH = "data/questions/" # hols questions including the augmented samples
 RESULTS_PATH = "data/results/" # holds responses of specified llm
+CACHE_PATH = "data/cache/" # holds response and evaluation caches
 
 # templates
 TEMP_IMPROPER = "data/templates/temp_improper.json"
@@ -0,0 +1,25 @@
+import argparse
+
+from utils.columnar import json_to_parquet, parquet_to_json
+
+"""
+
+    converts results and eval files between json and parquet, e.g.
+    data/results/bird_gpt-5_eval.json -> data/results/bird_gpt-5_eval.parquet
+    parquet requires pyarrow
+
+"""
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("paths", type=str, nargs="+", help="results or eval files (.json or .parquet)")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if path.endswith(".json"):
+            print(f"{path} -> {json_to_parquet(path)}")
+        elif path.endswith(".parquet"):
+            print(f"{path} -> {parquet_to_json(path)}")
+        else:
+            raise Exception(f"Unknown file format: {path}")
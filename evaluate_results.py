@@ -10,8 +10,18 @@ if __name__ == '__main__':
 
     parser.add_argument("--dataset", type=str, choices=["spider", "bird"], default="spider")
     parser.add_argument("--model", type=str, choices=["gpt-5", "gemini-2.5-pro", "qwen-3-80B", "llama-3.3-70B"], default="gpt-5")
+    parser.add_argument("--embed-backend", type=str, choices=["torch", "onnx"], default=None,
+                        help="backend of the message embedding model, onnx runs a quantised model on cpu")
+    parser.add_argument("--workers", type=int, default=1, help="processes executing the predicted sql")
+    parser.add_argument("--no-exec-cache", action="store_true", help="execute gold queries instead of using cached results")
+    parser.add_argument("--timeout", type=float, default=None, help="wall-clock seconds per BIRD query, predicted and gold each (default 30)")
+    parser.add_argument("--max-instructions", type=int, default=None, help="sqlite vm instruction budget per BIRD query, predicted and gold each")
+    parser.add_argument("--streaming", action="store_true", help="score results chunk by chunk with a resumable jsonl checkpoint")
+    parser.add_argument("--format", type=str, choices=["json", "parquet"], default="json", help="format of the eval file")
     args = parser.parse_args()
 
     
-    ev = Evaluator(dataset=args.dataset, model=args.model)
-    ev.fit_sql()
\ No newline at end of file
+    ev = Evaluator(dataset=args.dataset, model=args.model, embed_backend=args.embed_backend, streaming=args.streaming,
+                   output_format=args.format)
+    ev.fit_sql(workers=args.workers, exec_cache=not args.no_exec_cache,
+               timeout=args.timeout, max_instructions=args.max_instructions)
\ No newline at end of file
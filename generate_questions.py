@@ -1,4 +1,7 @@
+import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
 
 from models.question_generator import QuestionGenerator
 
@@ -6,23 +9,43 @@ from models.question_generator import QuestionGenerator
 
     generates questions and on the basis of schemas
     and stores them as json files in data/questions
+    databases are generated in parallel with --workers, every database
+    draws from its own seeded generator and results are merged in db_id order
 
 """
 
+_GENERATOR = None # one question generator per worker process
+
+def init_worker(dataset:str):
+    global _GENERATOR
+    _GENERATOR = QuestionGenerator(dataset=dataset)
+
+def generate_database(db_id:str, seed:int):
+    return _GENERATOR.generate_database(db_id, seed=seed)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--dataset", type=str, choices=["spider", "bird"], default="spider")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--seed", type=int, default=0, help="base seed of the per-database random generators")
     args = parser.parse_args()
 
     print(f"Starting question generation for {args.dataset}.")
 
     qg = QuestionGenerator(dataset=args.dataset)
+    db_ids = sorted(qg.distinct_dbs)
+
+    # map keeps the input order, so the merged questions do not depend on the number of workers
+    if args.workers <= 1:
+        generated = [qg.generate_database(db, seed=args.seed) for db in tqdm(db_ids)]
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.dataset,)) as executor:
+            generated = list(tqdm(executor.map(generate_database, db_ids, [args.seed] * len(db_ids)), total=len(db_ids)))
 
-    for db in qg.distinct_dbs:
-        qg.generate_improper(db)
-        qg.generate_unanswerable(db)
-        qg.generate_ambiguous(db)
+    for samples in generated:
+        qg.data.extend(samples)
 
     qg.calculate_statistics()
-    qg.save_questions_json()
\ No newline at end of file
+    qg.save_questions_json()
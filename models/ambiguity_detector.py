@@ -1,7 +1,10 @@
-#import torch
-#from sentence_transformers import SentenceTransformer, util
+import numpy as np
 
-# EMBEDDING_MODEL = SentenceTransformer("all-MiniLM-L6-v2")
+from models.embeddings import embed_texts
+
+
+SEMANTIC_MODEL = "all-MiniLM-L6-v2" # embeds column names for detect_semantical_ambiguity
+SIMILARITY_BLOCK_SIZE = 1024 # rows of the similarity matrix computed at once
 
 class AmbiguityDetector:
 
@@ -18,61 +21,80 @@ class AmbiguityDetector:
         self.ambiguous_aggregation_tables = None
         self.ambiguous_temporal_tables = None
         self.ambiguous_fk_tables = None
+        self.ambiguous_semantic_columns = None
 
+        self._build_index()
+
+
+    def _build_index(self):
+
+        # one pass over the schema, shared by all detect_* methods
+        self.columns = [] # (table, column object) in schema order
+        self.column_index = {} # lower-case column name -> {"tables": [...], "types": [...]}
+        self.fk_neighbours = {} # table -> tables linked to it by a foreign key in either direction
+        self.fk_targets = {} # table -> distinct referenced tables
 
-    def detect_column_ambiguity(self, ignore_ids=True):
-        
-        # ignore_ids: if true columns that end with "id" are ignored as well
-        # output format: { "column_name": "population", "tables": ["city", "country"] }
-        
-        # create object with all column names as key and tables array in which they appear as value
-        column_index = {}
         for table, meta in self.schema.items():
             for col in meta.get("columns", []):
+                self.columns.append((table, col))
+
                 col_name = col["name"].lower()
                 col_type = (col.get("typegroup") or "").upper()
-                if col_name not in column_index:
-                    column_index[col_name] = {"tables": [], "types": []}
-                column_index[col_name]["tables"].append(table)
-                if col_type and col_type not in column_index[col_name]["types"]:
-                    column_index[col_name]["types"].append(col_type)
-
-        # filter for columns that occur in more than one table
-        duplicate_columns = {
-            name: info
-            for name, info in column_index.items()
-            if len(info["tables"]) > 1
-        }
-        
-        fk_links = set()
-        fk_tables = [(tbl, meta.get("foreign_keys", [])) for tbl, meta in self.schema.items()]
+                if col_name not in self.column_index:
+                    self.column_index[col_name] = {"tables": [], "types": []}
+                self.column_index[col_name]["tables"].append(table)
+                if col_type and col_type not in self.column_index[col_name]["types"]:
+                    self.column_index[col_name]["types"].append(col_type)
+
+            for fk in meta.get("foreign_keys", []):
+                if not fk:
+                    continue
+                source = fk.get("sourceTable")
+                self.fk_neighbours.setdefault(table, set()).add(source)
+                self.fk_neighbours.setdefault(source, set()).add(table)
+                self.fk_targets.setdefault(table, set()).add(source)
+
+    def _columns_by_typegroup(self, groups:set):
+        # table -> columns whose typegroup is in groups, in schema order
+        matches = {}
+        for table, col in self.columns:
+            if (col.get("typegroup") or "").upper() in groups:
+                matches.setdefault(table, []).append(col)
+        return matches
 
-        # get cases where tables are linked by foreign keys
-        for t, fks in fk_tables:
-            for fk in fks:
-                pair = tuple(sorted([t, fk["sourceTable"]]))
-                fk_links.add(pair)
 
+    def detect_column_ambiguity(self, ignore_ids=True):
+        
+        # ignore_ids: if true columns that end with "id" are ignored as well
+        # output format: { "column_name": "population", "tables": ["city", "country"] }
+        
         ambiguous_columns = []
         
-        # only extract unlinked columns
-        for col_name, info in duplicate_columns.items():
+        # columns that occur in more than one table, only unlinked occurrences are extracted
+        for col_name, info in self.column_index.items():
 
-            if ignore_ids and col_name.lower().endswith("id"):
-                continue
-            
             tables = info["tables"]
-            unlinked_pairs = []
-            for i in range(len(tables)):
-                for j in range(i + 1, len(tables)):
-                    pair = tuple(sorted([tables[i], tables[j]]))
-                    if pair not in fk_links:
-                        unlinked_pairs.append(pair)
-
-            if unlinked_pairs:
+            if len(tables) < 2 or (ignore_ids and col_name.endswith("id")):
+                continue
+
+            # a table is part of an unlinked pair if some other occurrence is not linked to it by a
+            # foreign key; counted per table instead of testing every pair
+            occurrences = {}
+            for tbl in tables:
+                occurrences[tbl] = occurrences.get(tbl, 0) + 1
+
+            unlinked = []
+            for tbl, count in occurrences.items():
+                neighbours = self.fk_neighbours.get(tbl, ())
+                linked = sum(occurrences.get(other, 0) for other in neighbours if other != tbl)
+                same_table = count > 1 and tbl not in neighbours # column twice in one table
+                if len(tables) - count - linked > 0 or same_table:
+                    unlinked.append(tbl)
+
+            if unlinked:
                 ambiguous_columns.append({
                     "column_name": col_name,
-                    "tables": list({tbl for pair in unlinked_pairs for tbl in pair}),
+                    "tables": unlinked,
                     "types": info["types"]
                 })
 
@@ -82,21 +104,25 @@ class AmbiguityDetector:
 
     def detect_semantical_ambiguity(self, threshold=0.8):
         
-        # get all columns of the database
-        columns = []
-        for table, meta in self.schema.items():
-            for col in meta.get("columns", []):
-                columns.append({"table": table, 
-                                "column": col["name"], 
-                                "type": col.get("typegroup", "")})
+        # pairs of differently named columns with similar meaning, e.g. "salary" and "wage"
+        # output format: { "col1": "salary", "col2": "wage", "similarity": 0.83, "tables1": [...], "tables2": [...] }
+
+        # distinct column names of the database, identical names are covered by detect_column_ambiguity
+        tables = {}
+        for table, col in self.columns:
+            tables.setdefault(col["name"], []).append(table)
         
-        col_names = [c["column"] for c in columns]
+        col_names = list(tables)
 
         embeddings = self._compute_embeddings(col_names)
 
         pairs = self._find_similar_pairs(col_names, embeddings, threshold)
+        for pair in pairs:
+            pair["tables1"] = tables[pair["col1"]]
+            pair["tables2"] = tables[pair["col2"]]
 
-        print(pairs)
+        self.ambiguous_semantic_columns = pairs
+        return pairs
 
 
     def detect_aggregation_ambiguity(self):
@@ -104,18 +130,14 @@ class AmbiguityDetector:
         numeric_groups = {"INTEGER", "REAL", "NUMERIC"}
         ambiguous_aggregation_tables = []
 
-        for table, meta in self.schema.items():
-            numeric_cols = [
-                col for col in meta.get("columns", [])
-                if (col.get("typegroup") or "").upper() in numeric_groups
-            ]
+        for table, numeric_cols in self._columns_by_typegroup(numeric_groups).items():
 
             # only ambiguous if more than one numeric column
             if len(numeric_cols) > 1:
                 ambiguous_aggregation_tables.append({
                     "table": table,
                     "numeric_columns": [c["name"] for c in numeric_cols],
-                    "typegroups": list({c["typegroup"] for c in numeric_cols})
+                    "typegroups": list(dict.fromkeys(c["typegroup"] for c in numeric_cols))
                 })
 
         self.ambiguous_aggregation_tables = ambiguous_aggregation_tables
@@ -127,18 +149,12 @@ class AmbiguityDetector:
         temporal_groups = {"DATETIME", "DATE", "TIME"}
         ambiguous_temporal_tables = []
 
-        for table, meta in self.schema.items():
-            temporal_cols = [
-                col for col in meta.get("columns", [])
-                if (col.get("typegroup") or "").upper() in temporal_groups
-            ]
-
-            if len(temporal_cols) > 0:
-                ambiguous_temporal_tables.append({
-                    "table": table,
-                    "temporal_columns": [c["name"] for c in temporal_cols],
-                    "typegroups": list({c["typegroup"] for c in temporal_cols})
-                })
+        for table, temporal_cols in self._columns_by_typegroup(temporal_groups).items():
+            ambiguous_temporal_tables.append({
+                "table": table,
+                "temporal_columns": [c["name"] for c in temporal_cols],
+                "typegroups": list(dict.fromkeys(c["typegroup"] for c in temporal_cols))
+            })
 
         self.ambiguous_temporal_tables = ambiguous_temporal_tables
         return ambiguous_temporal_tables
@@ -148,49 +164,39 @@ class AmbiguityDetector:
         
         ambiguous_fk_tables = []
 
-        for table, meta in self.schema.items():
-            fks = meta.get("foreign_keys", [])
-            if not fks or len(fks) < 2:
-                continue  # skip tables with fewer than 2 foreign keys
-
-            # extract distinct referenced tables
-            referenced_tables = {fk.get("sourceTable") for fk in fks if fk}
-            if len(referenced_tables) >= 2: # only if at least two different tables are referenced
-                ambiguous_fk_tables.append({ "table": table, "foreign_keys": fks })
+        # only if at least two different tables are referenced
+        for table, referenced_tables in self.fk_targets.items():
+            if len(referenced_tables) >= 2:
+                ambiguous_fk_tables.append({ "table": table, "foreign_keys": self.schema[table]["foreign_keys"] })
 
         self.ambiguous_schema_graph_tables = ambiguous_fk_tables
         return ambiguous_fk_tables
     
     
     # utils
-    #def _compute_embeddings(self, texts):
-    #    EMBEDDING_MODEL = SentenceTransformer("all-MiniLM-L6-v2")
-    #    return EMBEDDING_MODEL.encode(
-    #        texts,
-    #        convert_to_tensor=True,
-    #        normalize_embeddings=True  # important: cosine = dot product
-    #    )
+    def _compute_embeddings(self, texts):
+        # normalised, so cosine similarity is a dot product; cached on disk per column name
+        return embed_texts(texts, name=SEMANTIC_MODEL)
     
-    def _find_similar_pairs(self, names, embeddings, threshold=0.8):
+    def _find_similar_pairs(self, names, embeddings, threshold=0.8, block_size=SIMILARITY_BLOCK_SIZE):
         """
         names: list of strings (column names)
-        embeddings: normalized tensor embeddings
+        embeddings: normalized embeddings, one row per name
         threshold: cosine similarity threshold
         """
-        sim_matrix = None#torch.matmul(embeddings, embeddings.T)
         n = len(names)
 
         pairs = []
 
-        for i in range(n):
-            for j in range(i + 1, n):  # ensures no duplicates + no self-pairs
-                score = sim_matrix[i, j].item()
-                if score >= threshold and score < 0.99:
-                    pairs.append({
-                        "col1": names[i],
-                        "col2": names[j],
-                        "similarity": score
-                    })
-        return pairs
-
+        # similarity matrix block by block, only the upper triangle (no duplicates + no self-pairs)
+        for start in range(0, n, block_size):
+            sim_block = embeddings[start:start + block_size] @ embeddings[start:].T
+            rows, cols = np.nonzero(np.triu((sim_block >= threshold) & (sim_block < 0.99), k=1))
 
+            for i, j in zip(rows, cols):
+                pairs.append({
+                    "col1": names[start + i],
+                    "col2": names[start + j],
+                    "similarity": float(sim_block[i, j])
+                })
+        return pairs
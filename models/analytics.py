@@ -0,0 +1,228 @@
+import os
+import numpy as np
+
+from configs.paths import RESULTS_PATH
+from utils.utils import normalize_question_type
+from utils.columnar import pq, require_pyarrow, find_existing
+from utils.json_io import load
+
+
+CATEGORIES = ["answerable", "unanswerable", "ambiguous", "improper"]
+PRED_CLASSES = CATEGORIES + [None] # None collects missing and unknown predictions
+AMBIGUITY_TYPES = ["ambiguous_column", "ambiguous_temporal", "ambiguous_aggregation",
+                   "ambiguous_schema", "ambiguous_linguistic"]
+
+_CODES = {category: code for code, category in enumerate(CATEGORIES)}
+_AMB_CODES = {amb_type: code for code, amb_type in enumerate(AMBIGUITY_TYPES)}
+NONE_CODE = len(CATEGORIES)
+
+# (dataset, model) -> (mtime, columns), eval files are parsed once per process
+_COLUMN_CACHE = {}
+
+
+class EvalTable:
+
+    """
+    Columnar view of the eval files of all given datasets and models
+    Every eval file is read once into numpy arrays, metrics are vectorised group-bys over them
+    """
+
+    def __init__(self, datasets:list, models:list):
+
+        self.datasets = list(datasets)
+        self.models = list(models)
+        if not self.datasets or not self.models:
+            raise ValueError("EvalTable needs at least one dataset and one model.")
+
+        parts = []
+        for d, dataset in enumerate(self.datasets):
+            for m, model in enumerate(self.models):
+                columns = load_eval_columns(dataset, model)
+                n = len(columns["fit"])
+                parts.append(dict(columns, dataset=np.full(n, d, dtype=np.int8), model=np.full(n, m, dtype=np.int8)))
+
+        self.columns = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+    def __len__(self):
+        return len(self.columns["fit"])
+
+    def mask(self, datasets:list=None, models:list=None):
+
+        mask = np.ones(len(self), dtype=bool)
+        if datasets is not None:
+            mask &= np.isin(self.columns["dataset"], [self.datasets.index(d) for d in datasets])
+        if models is not None:
+            mask &= np.isin(self.columns["model"], [self.models.index(m) for m in models])
+        return mask
+
+    def mean(self, column:str, mask):
+        values = self.columns[column][mask]
+        return values.mean() * 100 if len(values) else None
+
+    # fit-sql and tdex
+    def fit_tdex(self, dataset:str, model:str):
+        mask = self.mask([dataset], [model])
+        return self.mean("fit", mask), self.mean("tdex", mask), int(mask.sum())
+
+    # execution accuracy of answerable samples
+    def exa(self, dataset:str, model:str):
+        mask = self.mask([dataset], [model]) & (self.columns["gold"] == _CODES["answerable"])
+        return self.mean("response", mask), int(mask.sum())
+
+    # classification and response accuracy
+    def classification_response(self, dataset:str, model:str):
+        mask = self.mask([dataset], [model])
+        return self.mean("classification", mask), self.mean("response", mask), int(mask.sum())
+
+    # fit-sql per gold category
+    def type_fit(self, datasets:list=None, models:list=None):
+        mask = self.mask(datasets, models) & (self.columns["gold"] >= 0)
+        return self._group_mean(self.columns["gold"][mask], self.columns["fit"][mask], CATEGORIES)
+
+    # fit-sql per ambiguity type
+    def amb_type_fit(self, datasets:list=None, models:list=None):
+        mask = self.mask(datasets, models) & (self.columns["amb_type"] >= 0)
+        return self._group_mean(self.columns["amb_type"][mask], self.columns["fit"][mask], AMBIGUITY_TYPES)
+
+    # gold category x predicted category counts
+    def confusion(self, datasets:list=None, models:list=None):
+        mask = self.mask(datasets, models) & (self.columns["gold"] >= 0)
+        cells = self.columns["gold"][mask].astype(np.int64) * len(PRED_CLASSES) + self.columns["pred"][mask]
+        counts = np.bincount(cells, minlength=len(CATEGORIES) * len(PRED_CLASSES))
+        return counts.reshape(len(CATEGORIES), len(PRED_CLASSES))
+
+    def errors(self, datasets:list=None, models:list=None):
+        mask = self.mask(datasets, models)
+        return {
+            "total": int(mask.sum()),
+            "type_errors": int((self.columns["classification"][mask] != 1).sum()), # wrong type prediction
+            "sql_produced": int(self.columns["sql_produced"][mask].sum()), # sql produced when not allowed
+        }
+
+    def _group_mean(self, codes, values, labels:list):
+        counts = np.bincount(codes, minlength=len(labels))
+        sums = np.bincount(codes, weights=values, minlength=len(labels))
+        return {
+            label: (float(sums[code] / counts[code] * 100) if counts[code] > 0 else None)
+            for code, label in enumerate(labels)
+        }
+
+    def report(self):
+
+        for dataset in self.datasets:
+            for model in self.models:
+                fit, tdex, n = self.fit_tdex(dataset, model)
+                exa, _ = self.exa(dataset, model)
+                class_score, resp_score, _ = self.classification_response(dataset, model)
+                print(f"{dataset} | {model} | FIT: {fmt(fit)} | TDEX: {fmt(tdex)} | ExA: {fmt(exa)} "
+                      f"| Class: {fmt(class_score)} | Resp: {fmt(resp_score)} | Length: {n}")
+
+        for model in self.models:
+            print_averages(f"{model} | Class accuracies:", self.type_fit(models=[model]))
+            print_averages(f"{model} | Ambiguous class accuracies:", self.amb_type_fit(models=[model]))
+
+        for dataset in self.datasets:
+            print_confusion(dataset, self.confusion(datasets=[dataset]))
+
+        errors = self.errors()
+        print(f"Errors | Total: {errors['total']} | Type: {errors['type_errors']} | SQL produced: {errors['sql_produced']}")
+
+
+def load_eval_columns(dataset:str, model:str):
+
+    eval_path = find_existing(f"{RESULTS_PATH}{dataset}_{model}_eval.json")
+    if eval_path is None:
+        raise Exception("Create eval file with fit_sql() first.")
+
+    mtime = os.path.getmtime(eval_path)
+    cached = _COLUMN_CACHE.get((dataset, model))
+    if cached and cached[0] == (eval_path, mtime):
+        return cached[1]
+
+    if eval_path.endswith(".parquet"):
+        raw = _read_parquet_columns(eval_path)
+    else:
+        raw = _read_json_columns(eval_path)
+
+    n = len(raw["fit"])
+    gold = np.full(n, -1, dtype=np.int8)
+    amb_type = np.full(n, -1, dtype=np.int8)
+    pred = np.full(n, NONE_CODE, dtype=np.int8)
+    sql_empty = np.zeros(n, dtype=bool)
+
+    for i, (type_gold, type_pred, sql) in enumerate(zip(raw["type_gold"], raw["type_pred"], raw["sql"])):
+        gold[i] = _CODES.get(normalize_question_type(type_gold), -1)
+        amb_type[i] = _AMB_CODES.get(type_gold, -1)
+        pred[i] = _CODES.get(normalize_question_type(type_pred), NONE_CODE)
+        sql_empty[i] = sql is None or sql == "" or sql == "null"
+
+    fit = np.asarray(raw["fit"], dtype=np.float64)
+    classification = np.asarray(raw["classification"], dtype=np.float64)
+    response = np.asarray(raw["response"], dtype=np.float64)
+
+    answerable = gold == _CODES["answerable"]
+    columns = {
+        "gold": gold,
+        "amb_type": amb_type,
+        "pred": pred,
+        "fit": fit,
+        "classification": classification,
+        "response": response,
+        "tdex": np.where(answerable, response, classification), # same rule as Evaluator.TDEX()
+        "sql_produced": ~answerable & ~sql_empty,
+    }
+
+    _COLUMN_CACHE[(dataset, model)] = ((eval_path, mtime), columns)
+    return columns
+
+def _read_json_columns(eval_path:str):
+
+    eval = load(eval_path)
+
+    responses = [sample.get("response") or {} for sample in eval]
+    return {
+        "type_gold": [sample.get("type_gold") for sample in eval],
+        "type_pred": [response.get("type") for response in responses],
+        "sql": [response.get("sql") for response in responses],
+        "fit": [sample["fit_score"] for sample in eval],
+        "classification": [sample["classification_score"] for sample in eval],
+        "response": [sample["response_score"] for sample in eval],
+    }
+
+def _read_parquet_columns(eval_path:str):
+
+    # only the needed columns are read, messages and gold sql stay on disk
+    require_pyarrow()
+    table = pq.read_table(eval_path, columns=["type_gold", "response", "fit_score", "classification_score", "response_score"])
+    response = table.column("response").combine_chunks()
+    return {
+        "type_gold": table.column("type_gold").to_pylist(),
+        "type_pred": response.field("type").to_pylist(),
+        "sql": response.field("sql").to_pylist(),
+        "fit": table.column("fit_score").to_numpy(),
+        "classification": table.column("classification_score").to_numpy(),
+        "response": table.column("response_score").to_numpy(),
+    }
+
+
+# printing
+
+def fmt(value):
+    return "None" if value is None else round(float(value), 2)
+
+def print_averages(title:str, averages:dict):
+    print(title)
+    for cls, avg in averages.items():
+        print(f"  {cls:12s} : {avg:.3f}" if avg is not None else f"  {cls:12s} : None")
+
+def print_confusion(title:str, matrix):
+    print(title)
+    header = "Gold \\ Pred".ljust(14) + " ".join([str(c).ljust(12) for c in PRED_CLASSES])
+    print(header)
+    print("-" * len(header))
+
+    for g, gold in enumerate(CATEGORIES):
+        row = gold.ljust(14)
+        for p in range(len(PRED_CLASSES)):
+            row += str(matrix[g, p]).ljust(12)
+        print(row)
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+
+from models.llm import LLM, parse_tool_call, get_cached_tokens
+from utils.json_io import loads, dumps_line
+
+
+CHAT_ENDPOINT = "/v1/chat/completions"
+
+# purpose of uploaded batch input files per provider
+FILE_PURPOSES = {
+    "openai": "batch",
+    "together": "batch-api",
+}
+
+FINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchRunner:
+
+    """
+    Runs chat completion requests through the batch API of a provider
+    Writes the batch input jsonl, submits it, polls until the batch is done
+    and parses the output lines into the same response dicts as LLM.ask
+    """
+
+    def __init__(self, llm:LLM, input_path:str, output_path:str, state_path:str, poll_interval:float=60):
+
+        if llm.provider not in FILE_PURPOSES:
+            raise ValueError(f"Batch mode is not supported for provider {llm.provider}.")
+
+        self.llm = llm
+        self.input_path = input_path
+        self.output_path = output_path
+        self.state_path = state_path # keeps the batch id so an interrupted run resumes polling
+        self.poll_interval = poll_interval
+
+    def write_input(self, requests:list):
+
+        # requests: list of (custom_id, messages, cache_key)
+        with open(self.input_path, "w", encoding="utf-8") as f:
+            for custom_id, messages, cache_key in requests:
+                f.write(dumps_line({
+                    "custom_id": str(custom_id),
+                    "method": "POST",
+                    "url": CHAT_ENDPOINT,
+                    "body": self.llm._build_chat_kwargs(messages, cache_key)
+                }))
+
+    def submit(self):
+
+        with open(self.input_path, "rb") as f:
+            input_file = self.llm.client.files.create(file=f, purpose=FILE_PURPOSES[self.llm.provider])
+
+        batch = self.llm.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_ENDPOINT,
+            completion_window="24h"
+        )
+
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump({"batch_id": batch.id, "input_file_id": input_file.id}, f)
+
+        print(f"Submitted batch {batch.id}")
+        return batch.id
+
+    def load_batch_id(self):
+
+        if not os.path.exists(self.state_path):
+            return None
+
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("batch_id")
+
+    def poll(self, batch_id:str):
+
+        while True:
+            batch = self.llm.client.batches.retrieve(batch_id)
+            if batch.status in FINAL_STATES:
+                break
+
+            counts = batch.request_counts
+            if counts:
+                print(f"Batch {batch_id} {batch.status}: {counts.completed}/{counts.total} completed")
+            time.sleep(self.poll_interval)
+
+        if batch.status != "completed":
+            print(f"Batch {batch_id} ended with status {batch.status}")
+
+        return batch
+
+    def download(self, batch):
+
+        content = self.llm.client.files.content(batch.output_file_id)
+        with open(self.output_path, "wb") as f:
+            f.write(content.read())
+
+    def parse_outputs(self):
+
+        # custom_id -> response dict, failed requests are left out and can be resubmitted
+        responses = {}
+
+        with open(self.output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                row = loads(line)
+                response = row.get("response") or {}
+                if row.get("error") or response.get("status_code") != 200:
+                    print(f"Request {row.get('custom_id')} failed: {row.get('error') or response.get('status_code')}")
+                    continue
+
+                responses[row["custom_id"]] = self._parse_body(response["body"])
+
+        return responses
+
+    def run(self, requests:list):
+
+        # requests already in the response cache are served from it and not submitted
+        chat_kwargs = {str(custom_id): self.llm._build_chat_kwargs(messages, cache_key)
+                       for custom_id, messages, cache_key in requests}
+        responses = {}
+        for custom_id, kwargs in chat_kwargs.items():
+            cached = self.llm._cache_get(kwargs)
+            if cached:
+                responses[custom_id] = cached
+
+        misses = [request for request in requests if str(request[0]) not in responses]
+
+        # resume polling if a batch was already submitted for this run
+        batch_id = self.load_batch_id()
+        if batch_id is None:
+            if not misses:
+                return responses
+            self.write_input(misses)
+            batch_id = self.submit()
+
+        batch = self.poll(batch_id)
+
+        if batch.output_file_id:
+            self.download(batch)
+            for custom_id, response in self.parse_outputs().items():
+                if custom_id in chat_kwargs:
+                    self.llm._cache_put(chat_kwargs[custom_id], response)
+                responses[custom_id] = response
+
+        os.remove(self.state_path) # next run submits the remaining requests again
+        return responses
+
+    def _parse_body(self, body:dict):
+
+        message = body["choices"][0]["message"]
+        tool_calls = message.get("tool_calls") or []
+        usage = body.get("usage") or {}
+
+        return {
+            "response": parse_tool_call(tool_calls[0]["function"]["arguments"] if tool_calls else None),
+            "completion_tokens": usage.get("completion_tokens"),
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "cached_tokens": get_cached_tokens(usage),
+            "total_tokens": usage.get("total_tokens"),
+            "model": self.llm.model,
+            "provider": self.llm.provider,
+            "duration_seconds": None, # not measurable per request in batch mode
+        }
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+from urllib.parse import quote
+
+
+# applied to every pooled connection, tuned for read-heavy evaluation on large databases
+PRAGMAS = {
+    "mmap_size": 1024 ** 3, # map up to 1 GiB of the file instead of copying pages into the cache
+    "cache_size": -64 * 1024, # 64 MiB page cache (negative values are KiB)
+    "temp_store": "MEMORY", # sorting and grouping without temp files
+}
+
+# one connection per database per process, connections must not be shared across fork
+_POOL = {}
+_POOL_PID = None
+
+
+def get_connection(db_path:str):
+
+    global _POOL, _POOL_PID
+
+    if _POOL_PID != os.getpid():
+        _POOL = {} # inherited from the parent process, open new ones
+        _POOL_PID = os.getpid()
+
+    if db_path not in _POOL:
+        _POOL[db_path] = open_readonly(db_path)
+
+    return _POOL[db_path]
+
+
+def open_readonly(db_path:str):
+
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"No database found at {db_path}")
+
+    # immutable: sqlite skips locking and change detection, the benchmark databases are never written
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    for pragma, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+    return conn
+
+
+def close_connection(db_path:str):
+    conn = _POOL.pop(db_path, None)
+    if conn and _POOL_PID == os.getpid():
+        conn.close()
+
+
+def close_all():
+    for db_path in list(_POOL):
+        close_connection(db_path)
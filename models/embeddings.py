@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import hashlib
+import numpy as np
+from functools import lru_cache
+
+from configs.paths import CACHE_PATH
+
+
+EMBED_MODEL_NAME = "BAAI/bge-small-en"
+
+# torch | onnx (quantised int8 model on cpu, requires optimum[onnxruntime])
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+ONNX_QUANTIZATION = "avx2"
+EMBED_BATCH_SIZE = 256
+
+
+@lru_cache(maxsize=None)
+def get_embed_model(name:str=EMBED_MODEL_NAME, backend:str=None):
+
+    # imported on first use only, sentence_transformers pulls in torch
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or EMBED_BACKEND
+
+    if backend == "torch":
+        return SentenceTransformer(name)
+    elif backend == "onnx":
+        return _load_quantized_onnx(name)
+    else:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+def _load_quantized_onnx(name:str):
+
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    # quantised export is created once and reused from the local cache afterwards
+    local_dir = f"{CACHE_PATH}onnx/{name.replace('/', '__')}"
+    file_name = f"onnx/model_qint8_{ONNX_QUANTIZATION}.onnx"
+
+    if not os.path.exists(os.path.join(local_dir, file_name)):
+        model = SentenceTransformer(name, backend="onnx")
+        model.save_pretrained(local_dir)
+        export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION, local_dir)
+
+    return SentenceTransformer(local_dir, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+class EmbeddingCache:
+
+    """
+    Normalised float32 embeddings of short texts (e.g. column names) in sqlite
+    Keyed by model, backend and text, so every text is embedded once per model
+    """
+
+    def __init__(self, path:str=None):
+
+        self.path = path or f"{CACHE_PATH}embeddings.sqlite"
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # shared by parallel question generation processes
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                                key TEXT PRIMARY KEY,
+                                vector BLOB NOT NULL
+                             )""")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def make_key(name:str, backend:str, text:str):
+        return hashlib.sha256("\0".join([name, backend, text]).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys:list):
+
+        vectors = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            vectors.update({key: np.frombuffer(vector, dtype=np.float32) for key, vector in rows})
+
+        return vectors
+
+    def put_many(self, vectors:dict):
+        self.conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                              [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()])
+        self.conn.commit()
+
+
+def embed_texts(texts:list, name:str=EMBED_MODEL_NAME, backend:str=None, use_cache:bool=True):
+
+    # returns a (len(texts), dim) float32 matrix of normalised embeddings, rows in the order of texts;
+    # distinct texts missing from the cache are encoded in one batched call
+    backend = backend or EMBED_BACKEND
+    unique = list(dict.fromkeys(texts))
+
+    cache = EmbeddingCache() if use_cache else None
+    keys = {text: EmbeddingCache.make_key(name, backend, text) for text in unique}
+    stored = cache.get_many(list(keys.values())) if cache else {}
+
+    vectors = {text: stored[keys[text]] for text in unique if keys[text] in stored}
+    missing = [text for text in unique if text not in vectors]
+
+    if missing:
+        encoded = get_embed_model(name, backend).encode(missing, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True,
+                                                        normalize_embeddings=True, show_progress_bar=False)
+        encoded = encoded.astype(np.float32)
+        vectors.update(zip(missing, encoded))
+        if cache:
+            cache.put_many({keys[text]: vector for text, vector in zip(missing, encoded)})
+
+    if cache:
+        cache.close()
+
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([vectors[text] for text in texts])
@@ -1,17 +1,15 @@
-
 import os
-import json
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-from func_timeout import func_timeout
-from sentence_transformers import SentenceTransformer, util
 
 from configs.paths import RESULTS_PATH, SPIDER_DATABASE_PATH, BIRD_DATABASE_PATH
-from external.testsuitesqleval.exec_eval import eval_exec_match
-from external.bird.evaluation import execute_sql
-
-
-EMBED_MODEL = SentenceTransformer("BAAI/bge-small-en")
+from utils.utils import read_jsonl, open_jsonl_append, normalize_question_type
+from utils.columnar import load_rows, iter_rows, save_rows, with_format, find_existing, require_pyarrow
+from utils.json_io import dumps_line
+from models.analytics import EvalTable, print_averages, print_confusion, fmt
+from models.embeddings import get_embed_model
+from models.sql_executor import execute_job, execute_all, BIRD_TIMEOUT
 
 CLASS_WEIGHT = 0.3
 RESPONSE_WEIGHT = 0.7
@@ -20,6 +18,8 @@ RESPONSE_WEIGHT = 0.7
 T_LOW = 0.40
 T_HIGH = 0.80
 IMPROPER_MAX_TOKENS = 20
+EMBED_BATCH_SIZE = 256
+STREAM_CHUNK_SIZE = 500 # rows scored and appended to the eval checkpoint at once
 
 TEMPLATES = {
     "ambiguous": [
@@ -43,51 +43,155 @@ TEMPLATES = {
 
 class Evaluator:
 
-    def __init__(self, dataset:str=None, model:str=None):
+    def __init__(self, dataset:str=None, model:str=None, embed_backend:str=None, streaming:bool=False,
+                 output_format:str="json"):
 
         self.dataset = dataset
         self.model = model
+        self.embed_backend = embed_backend
+        self._template_embeddings = None
+
+        # fail before hours of scoring rather than when the eval file is written
+        if output_format == "parquet":
+            require_pyarrow()
         
         if self.dataset == "spider":
             self.db_path = SPIDER_DATABASE_PATH
         elif self.dataset == "bird":
             self.db_path = BIRD_DATABASE_PATH
 
-        with open(f"{RESULTS_PATH}{self.dataset}_{self.model}_results.json", "r") as f: 
-            self.results = json.load(f)
+        # results may be stored as json or parquet
+        self.results_path = f"{RESULTS_PATH}{self.dataset}_{self.model}_results.json"
+        self.results_path = find_existing(self.results_path) or self.results_path
+        self.results_jsonl_path = f"{RESULTS_PATH}{self.dataset}_{self.model}_results.jsonl"
+
+        # in streaming mode results are read row by row in fit_sql()
+        self.results = None
+        if not streaming:
+            self.results = load_rows(self.results_path)
+        
+        self.eval_path = with_format(f"{RESULTS_PATH}{self.dataset}_{self.model}_eval.json", output_format)
+        self.eval_jsonl_path = f"{RESULTS_PATH}{self.dataset}_{self.model}_eval.jsonl" # checkpoint of streaming mode
+
+    # embedding model and templates are only loaded once messages are scored
+    @property
+    def embed_model(self):
+        return get_embed_model(backend=self.embed_backend)
+
+    @property
+    def template_embeddings(self):
+        # one normalized matrix (n_templates x dim) per category, cosine similarity becomes a dot product
+        if self._template_embeddings is None:
+            self._template_embeddings = {
+                category: self.embed_model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+                for category, texts in TEMPLATES.items()
+            }
+        return self._template_embeddings
+
+
+    def fit_sql(self, workers:int=1, exec_cache:bool=True, timeout:float=None, max_instructions:int=None):
         
-        self.template_embeddings = {
-            category: [EMBED_MODEL.encode(text, convert_to_tensor=True) for text in texts]
-            for category, texts in TEMPLATES.items()
-        }
+        if find_existing(self.eval_path):
+            raise Exception("Evaluation files already generated")
 
-        self.eval_path = f"{RESULTS_PATH}{self.dataset}_{self.model}_eval.json"
+        if self.results is None:
+            return self.fit_sql_streaming(workers=workers, exec_cache=exec_cache, timeout=timeout,
+                                          max_instructions=max_instructions)
 
+        if not self.results:
+            raise ValueError(f"No results to evaluate in {self.results_path}")
 
-    def fit_sql(self):
+        self.score_results(self.results, workers=workers, exec_cache=exec_cache, timeout=timeout,
+                           max_instructions=max_instructions)
         
-        if os.path.exists(self.eval_path):
-            raise Exception("Evaluation files already generated")
+        save_rows(self.results, self.eval_path)
 
-        total_score = 0
+        total_score = sum(result["fit_score"] for result in self.results)
+        print(f"FIT-SQL for {self.model} in {self.dataset}: {total_score / len(self.results)}")
+        return total_score / len(self.results)
 
-        for _, result in tqdm(enumerate(self.results)):
+    def fit_sql_streaming(self, workers:int=1, exec_cache:bool=True, timeout:float=None, max_instructions:int=None,
+                          chunk_size:int=STREAM_CHUNK_SIZE):
+
+        # scores results chunk by chunk and appends them to the eval jsonl checkpoint,
+        # an interrupted run resumes after the rows already scored
+        scored = {row["index"] for row in read_jsonl(self.eval_jsonl_path)}
+        if scored:
+            print(f"Resuming evaluation, {len(scored)} samples already scored")
+
+        # one pool for all chunks, so workers keep their connections and caches warm across chunks
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            with open_jsonl_append(self.eval_jsonl_path) as eval_out:
+                chunk = []
+                for result in tqdm(self.iter_results()):
+                    if result["index"] in scored:
+                        continue
+
+                    chunk.append(result)
+                    if len(chunk) >= chunk_size:
+                        self._score_and_append(chunk, eval_out, workers, exec_cache, timeout, max_instructions, executor)
+                        chunk = []
+
+                if chunk:
+                    self._score_and_append(chunk, eval_out, workers, exec_cache, timeout, max_instructions, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # final json in index order, built once from the checkpoint
+        rows = {row["index"]: row for row in read_jsonl(self.eval_jsonl_path)}
+        evaluated = [rows[index] for index in sorted(rows)]
+        if not evaluated:
+            raise ValueError(f"No results to evaluate in {self.results_path}")
+
+        save_rows(evaluated, self.eval_path)
+
+        total_score = sum(result["fit_score"] for result in evaluated)
+        print(f"FIT-SQL for {self.model} in {self.dataset}: {total_score / len(evaluated)}")
+        return total_score / len(evaluated)
+
+    def iter_results(self):
+
+        # finished results file if available, otherwise the jsonl backup of prompt_model.py
+        if os.path.exists(self.results_path):
+            yield from iter_rows(self.results_path)
+        elif os.path.exists(self.results_jsonl_path):
+            yield from read_jsonl(self.results_jsonl_path)
+        else:
+            raise FileNotFoundError(f"No results found at {self.results_path}")
+
+    def score_results(self, results:list, workers:int=1, exec_cache:bool=True, timeout:float=None,
+                      max_instructions:int=None, executor:ProcessPoolExecutor=None):
+
+        # execute all predicted queries in parallel and embed and score all messages at once
+        exec_results = self.score_executions(results, workers=workers, use_cache=exec_cache,
+                                             timeout=timeout, max_instructions=max_instructions, executor=executor)
+        message_scores = self.score_messages(results)
+
+        for i, result in enumerate(results):
+
+            exec_score, exec_status = exec_results.get(i, (None, None))
 
             classification_score = self.classification_accuracy(result)
-            response_score = self.response_accuracy(result)
+            response_score = self.response_accuracy(result, message_score=message_scores.get(i),
+                                                    exec_score=exec_score)
             fit_score = CLASS_WEIGHT * classification_score + RESPONSE_WEIGHT * response_score
 
-            total_score += fit_score
-
             result["classification_score"] = classification_score
             result["response_score"] = response_score
             result["fit_score"] = fit_score
-        
-        with open(self.eval_path, "w", encoding="utf-8") as f:
-            json.dump(self.results, f, indent=4)
+            if exec_status:
+                result["exec_status"] = exec_status
 
-        print(f"FIT-SQL for {self.model} in {self.dataset}: {total_score / len(self.results)}")
-        return total_score / len(self.results)
+        return results
+
+    def _score_and_append(self, chunk:list, eval_out, workers, exec_cache, timeout, max_instructions, executor=None):
+        self.score_results(chunk, workers=workers, exec_cache=exec_cache, timeout=timeout,
+                           max_instructions=max_instructions, executor=executor)
+        for result in chunk:
+            eval_out.write(dumps_line(result))
+        eval_out.flush()
 
 
     def classification_accuracy(self, result_dict:dict):
@@ -97,12 +201,12 @@ class Evaluator:
         if gold_type is None: raise ValueError("Gold type must not be None.")
         if pred_type is None: return 0
 
-        if normalize_type(gold_type) == normalize_type(pred_type):
+        if normalize_question_type(gold_type) == normalize_question_type(pred_type):
             return 1
         else:
             return 0
 
-    def response_accuracy(self, result_dict:dict):
+    def response_accuracy(self, result_dict:dict, message_score:float=None, exec_score:float=None):
         
         db_id = result_dict.get("db_id")
         gold_sql = result_dict.get("sql_gold")
@@ -121,292 +225,138 @@ class Evaluator:
         
         # not answerable but sql predicted
         empty_pred_sql = pred_sql is None or pred_sql == "null" or pred_sql == ""
-        if normalize_type(gold_type) != "answerable" and not empty_pred_sql:
+        if normalize_question_type(gold_type) != "answerable" and not empty_pred_sql:
             return 0
 
-        if normalize_type(gold_type) == "answerable":
+        if normalize_question_type(gold_type) == "answerable":
+            if exec_score is not None:
+                return exec_score
             return self.execution_accuracy(db_id=db_id, gold_sql=gold_sql, pred_sql=pred_sql)
+        elif message_score is not None:
+            return message_score
         else:
-            return self.message_accuracy(message=message, templates=self.template_embeddings[normalize_type(gold_type)])
+            return self.message_accuracy(message=message, templates=self.template_embeddings[normalize_question_type(gold_type)])
 
     def execution_accuracy(self, db_id:str, gold_sql:str, pred_sql:str):
-        
-        if pred_sql is None or pred_sql == "":
-            return 0
 
         db = f"{self.db_path}{db_id}/{db_id}.sqlite"
 
-        if self.dataset == "spider":
-            exec_score = eval_exec_match(db=db, p_str=pred_sql, g_str=gold_sql, plug_value=False,
-                                             keep_distinct=True, progress_bar_for_each_datapoint=False)
-        elif self.dataset == "bird":
-            try:
-                exec_score = func_timeout(30, execute_sql, args=(pred_sql, gold_sql, db))
-            except:
-                exec_score = 0
-        else:
-            raise Exception("Uknown dataset during evaluation.")
-        
+        exec_score, _ = execute_job(dataset=self.dataset, db_path=db, pred_sql=pred_sql, gold_sql=gold_sql)
         return exec_score
 
-    def message_accuracy(self, message:str=None, templates:list=None):
+    def score_executions(self, results:list, workers:int=1, use_cache:bool=True, timeout:float=None,
+                         max_instructions:int=None, executor:ProcessPoolExecutor=None):
+
+        # returns {position in results: (execution score, status)} for all answerable samples with predicted sql
+        jobs = []
+        for i, result in enumerate(results):
+            pred_sql = (result.get("response") or {}).get("sql")
+            if normalize_question_type(result.get("type_gold")) == "answerable" and pred_sql:
+                jobs.append((i, result.get("db_id"), pred_sql, result.get("sql_gold")))
+
+        if not jobs:
+            return {}
+
+        return execute_all(dataset=self.dataset, db_root=self.db_path, jobs=jobs, workers=workers, use_cache=use_cache,
+                           timeout=timeout or BIRD_TIMEOUT, max_instructions=max_instructions, executor=executor)
+
+    def message_accuracy(self, message:str=None, templates=None):
         
         if message is None or message == "":
             return 0
         
-        message_embedding = EMBED_MODEL.encode(message, convert_to_tensor=True)
+        message_embedding = self.embed_model.encode([message], convert_to_numpy=True, normalize_embeddings=True)
 
-        similarity_scores = []
-        for template in templates:
-            sim = util.cos_sim(message_embedding, template).item()
-            similarity_scores.append(sim)
+        s = (message_embedding @ templates.T).max()
 
-        s = max(similarity_scores)
+        return float(similarity_to_score(s))
 
-        if s <= T_LOW:
-            return 0
-        elif s >= T_HIGH:
-            return 1
-        else:
-            return (s - T_LOW) / (T_HIGH - T_LOW)
+    def score_messages(self, results:list):
+
+        # returns {position in results: message score} for all non-answerable samples with a message
+        positions = {category: [] for category in TEMPLATES}
+        messages = {category: [] for category in TEMPLATES}
+
+        for i, result in enumerate(results):
+            category = normalize_question_type(result.get("type_gold"))
+            message = (result.get("response") or {}).get("message")
+            if category in TEMPLATES and message:
+                positions[category].append(i)
+                messages[category].append(message)
+
+        scores = {}
+        for category, texts in messages.items():
+            if not texts:
+                continue
+
+            embeddings = self.embed_model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True,
+                                            normalize_embeddings=True, show_progress_bar=False)
+
+            # (n_messages x dim) @ (dim x n_templates) -> best template per message
+            similarities = (embeddings @ self.template_embeddings[category].T).max(axis=1)
+            scores.update(zip(positions[category], similarity_to_score(similarities).tolist()))
+
+        return scores
 
     def TDEX(self):
         
         # eval file needs to be created first
         if os.path.exists(self.eval_path):
-            with open(self.eval_path, "r") as f: 
-                eval = json.load(f)
+            eval = load_rows(self.eval_path)
         else:
             raise Exception("Creat eval file with fit_sql() first.")
         
         for sample in tqdm(eval):
 
-            if normalize_type(sample["type_gold"]) == "answerable":
+            if normalize_question_type(sample["type_gold"]) == "answerable":
                 tdexa = sample["response_score"]
             else:
                 tdexa = sample["classification_score"]
             
             sample["tdex_score"] = tdexa
         
-        with open(self.eval_path, "w", encoding="utf-8") as f:
-            json.dump(eval, f, indent=4)
+        save_rows(eval, self.eval_path)
         
         return True
 
 
+    # analysis helpers, eval files are loaded once into a columnar EvalTable
+
     # fit-sql and tdex
     def analyze_fit_tdex(self):
-        # eval file needs to be created first
-        if os.path.exists(self.eval_path):
-            with open(self.eval_path, "r") as f: 
-                eval = json.load(f)
-        else:
-            raise Exception("Create eval file with fit_sql() first.")
-        
-        total_fit = 0
-        total_tdex = 0
-        for sample in eval:
-            total_fit += sample["fit_score"]
-            total_tdex += sample["tdex_score"]
-        
-        fit_score = round(total_fit / len(eval) * 100, 2)
-        tdex_score = round(total_tdex / len(eval) * 100, 2)
-        print(f"{self.dataset} | {self.model} | FIT: {fit_score} | TDEX: {tdex_score} | Length: {len(eval)}")
+        fit, tdex, n = EvalTable([self.dataset], [self.model]).fit_tdex(self.dataset, self.model)
+        print(f"{self.dataset} | {self.model} | FIT: {fmt(fit)} | TDEX: {fmt(tdex)} | Length: {n}")
     
     # exa
     def analyze_exa(self):
-        # eval file needs to be created first
-        if os.path.exists(self.eval_path):
-            with open(self.eval_path, "r") as f: 
-                eval = json.load(f)
-        else:
-            raise Exception("Create eval file with fit_sql() first.")
-        
-        exa = 0
-        exa_count = 0
-        for sample in eval:
-            if normalize_type(sample["type_gold"]) == "answerable":
-                exa += sample["response_score"]
-                exa_count += 1
-        
-        total_exa = round(exa / exa_count * 100, 2)
-        print(f"{self.dataset} | {self.model} | ExA: {total_exa} | Length: {exa_count}")
+        exa, n = EvalTable([self.dataset], [self.model]).exa(self.dataset, self.model)
+        print(f"{self.dataset} | {self.model} | ExA: {fmt(exa)} | Length: {n}")
 
     # classification and response accuracy
     def analyze_classification_response(self):
-        # eval file needs to be created first
-        if os.path.exists(self.eval_path):
-            with open(self.eval_path, "r") as f: 
-                eval = json.load(f)
-        else:
-            raise Exception("Create eval file with fit_sql() first.")
-        
-        total_class = 0
-        total_resp = 0
-        for sample in eval:
-            total_class += sample["classification_score"]
-            total_resp += sample["response_score"]
-        
-        class_score = round(total_class / len(eval) * 100, 2)
-        resp_score = round(total_resp / len(eval) * 100, 2)
-        print(f"{self.dataset} | {self.model} | Class: {class_score} | Resp: {resp_score} | Length: {len(eval)}")
+        class_score, resp_score, n = EvalTable([self.dataset], [self.model]).classification_response(self.dataset, self.model)
+        print(f"{self.dataset} | {self.model} | Class: {fmt(class_score)} | Resp: {fmt(resp_score)} | Length: {n}")
 
     # fit-sql per type 
     def analyze_type_fit(self, datasets:list=None):
-
-        categories = ["answerable", "unanswerable", "ambiguous", "improper"]
-        totals = {key: {"fit": 0.0, "count": 0} for key in categories}
-
-        for dataset in datasets:
-            # eval file needs to be created first
-            eval_path = f"{RESULTS_PATH}{dataset}_{self.model}_eval.json" # use passed datasets
-            if os.path.exists(eval_path):
-                with open(eval_path, "r") as f: 
-                    eval = json.load(f)
-            else:
-                raise Exception("Create eval file with fit_sql() first.")
-            
-            for sample in eval:
-                t = normalize_type(sample["type_gold"])
-                totals[t]["fit"] += sample["fit_score"]
-                totals[t]["count"] += 1
-            
-        averages = {
-            key: (totals[key]["fit"] / totals[key]["count"] * 100
-                if totals[key]["count"] > 0 else None)
-            for key in categories
-        }
-        
-        print(f"{self.model} | Class accuracies:")
-        for cls, avg in averages.items():
-            print(f"  {cls:12s} : {avg:.3f}" if avg is not None else f"  {cls:12s} : None")
+        averages = EvalTable(datasets, [self.model]).type_fit()
+        print_averages(f"{self.model} | Class accuracies:", averages)
 
     def analyze_amb_type(self, datasets:list=None):
-        categories = ["ambiguous_column", "ambiguous_temporal", "ambiguous_aggregation", 
-                      "ambiguous_schema", "ambiguous_linguistic"]
-        totals = {key: {"fit": 0.0, "count": 0} for key in categories}
-
-        for dataset in datasets:
-            # eval file needs to be created first
-            eval_path = f"{RESULTS_PATH}{dataset}_{self.model}_eval.json" # use passed datasets
-            if os.path.exists(eval_path):
-                with open(eval_path, "r") as f: 
-                    eval = json.load(f)
-            else:
-                raise Exception("Create eval file with fit_sql() first.")
-            
-            for sample in eval:
-                if normalize_type(sample["type_gold"]) == "ambiguous":
-                    t = sample["type_gold"]
-                    totals[t]["fit"] += sample["fit_score"]
-                    totals[t]["count"] += 1
-            
-        averages = {
-            key: (totals[key]["fit"] / totals[key]["count"] * 100
-                if totals[key]["count"] > 0 else None)
-            for key in categories
-        }
-        
-        print(f"{self.model} | Ambiguous class accuracies:")
-        for cls, avg in averages.items():
-            print(f"  {cls:12s} : {avg:.3f}" if avg is not None else f"  {cls:12s} : None")
+        averages = EvalTable(datasets, [self.model]).amb_type_fit()
+        print_averages(f"{self.model} | Ambiguous class accuracies:", averages)
 
     def analyze_confusion(self, models:list=None):
-
-        gold_classes = ["answerable", "unanswerable", "ambiguous", "improper"]
-        pred_classes = ["answerable", "unanswerable", "ambiguous", "improper", None]
-
-        # Initialize empty confusion matrix
-        matrix = {
-            gold: {pred: 0 for pred in pred_classes}
-            for gold in gold_classes
-        }    
+        matrix = EvalTable([self.dataset], models).confusion()
+        print_confusion(self.dataset, matrix)
         
-        for model in models:
-            # eval file needs to be created first
-            eval_path = f"{RESULTS_PATH}{self.dataset}_{model}_eval.json" # use passed models
-            if os.path.exists(eval_path):
-                with open(eval_path, "r") as f: 
-                    eval = json.load(f)
-            else:
-                raise Exception("Create eval file with fit_sql() first.")        
-        
-            for sample in eval:
-                gold = normalize_type(sample.get("type_gold"))
-                pred = normalize_type(sample.get("response", {}).get("type"))
+    def analyze_errors(self, datasets:list=None, models:list=None):
+        errors = EvalTable(datasets, models).errors()
+        print(f"Errors | Total: {errors['total']} | Type: {errors['type_errors']} | SQL produced: {errors['sql_produced']}")
+        return errors
 
-                if gold not in gold_classes:
-                    continue
-                if pred not in pred_classes:
-                    pred = None
 
-                matrix[gold][pred] += 1
-        
-        
-        pred_classes = list(next(iter(matrix.values())).keys())
-
-        print(self.dataset)
-        header = "Gold \\ Pred".ljust(14) + " ".join([str(c).ljust(12) for c in pred_classes])
-        print(header)
-        print("-" * len(header))
-
-        for gold, row_data in matrix.items():
-            row = gold.ljust(14)
-            for pred in pred_classes:
-                row += str(row_data[pred]).ljust(12)
-            print(row)
-        
-    def analyze_errors(self, datasets:list=None, models:list=None):
-        
-        total_count = 0
-        type_error_count = 0 # wrong type prediction
-        sql_produced_count = 0 # SQL produced when not allowed
-        clarification_count = 0
-        explanation_count = 0
-        invalid_sql_count = 0
-        output_formatting_errors = 0
-
-        for dataset in datasets:
-            for model in models:
-
-                eval_path = f"{RESULTS_PATH}{dataset}_{model}_eval.json" # use passed models
-                if os.path.exists(eval_path):
-                    with open(eval_path, "r") as f: 
-                        eval = json.load(f)
-                else:
-                    raise Exception("Create eval file with fit_sql() first.")   
-
-                for sample in eval:
-                    total_count += 1
-                    
-                    if sample["classification_score"] != 1:
-                        type_error_count += 1
-                    
-                    sql = sample.get("response", {}).get("sql")
-                    sql_empty = sql is None or sql == "" or sql == "null"
-                    if normalize_type(sample["type_gold"]) != "answerable" and not sql_empty:
-                        sql_produced_count += 1
-                    
-                    if normalize_type(sample["type_gold"]) != "answerable":
-                        pass
-
-
-
-def normalize_type(type_name:str):
-
-    if type_name is None:
-        return None
-
-    if "ambiguous" in type_name.lower():
-        return "ambiguous"
-    elif "improper" in type_name.lower():
-        return "improper"
-    elif "unanswerable" in type_name.lower():
-        return "unanswerable"
-    elif "answerable" in type_name.lower() or "sql" in type_name.lower():
-        return "answerable"
-    else: 
-        try:
-            return type_name.lower()
-        except:
-            return type_name
\ No newline at end of file
+
+def similarity_to_score(s):
+    # 0 below T_LOW, 1 above T_HIGH, linear in between (works on scalars and arrays)
+    return np.clip((s - T_LOW) / (T_HIGH - T_LOW), 0, 1)
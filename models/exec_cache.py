@@ -0,0 +1,196 @@
+import os
+import zlib
+import pickle
+import sqlite3
+import hashlib
+
+from configs.paths import CACHE_PATH
+from utils.utils import file_hash
+
+
+MAX_RESULT_BYTES = 64 * 1024 ** 2 # larger gold results are not cached
+
+
+class ExecutionCache:
+
+    """
+    Persistent cache for execution accuracy in sqlite
+    Stores gold query result sets keyed on (dataset, db_id, normalized gold sql, db file hash),
+    so gold queries are executed once across all evaluated models
+    Result sets are stored as zlib compressed pickles of the distinct rows
+    Also memoises scores of (db_id, canonical pred sql, canonical gold sql) across sessions
+    """
+
+    def __init__(self, path:str=None):
+
+        self.path = path or f"{CACHE_PATH}execution.sqlite"
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # one instance per process (see sql_executor.get_exec_cache), WAL lets the workers read and write concurrently
+        self.conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS gold_results (
+                                key TEXT PRIMARY KEY,
+                                rows BLOB NOT NULL
+                             )""")
+        # caches written before statuses were recorded lack the column, their scores are dropped and recomputed
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(exec_scores)")]
+        if columns and "status" not in columns:
+            self.conn.execute("DROP TABLE exec_scores")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS exec_scores (
+                                key TEXT PRIMARY KEY,
+                                score INTEGER NOT NULL,
+                                status TEXT NOT NULL
+                             )""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS file_hashes (
+                                path TEXT PRIMARY KEY,
+                                size INTEGER NOT NULL,
+                                mtime_ns INTEGER NOT NULL,
+                                hash TEXT NOT NULL
+                             )""")
+        self.conn.commit()
+
+        self.db_hashes = {} # db path -> content hash, per process
+
+    def db_hash(self, db_path:str):
+
+        if db_path in self.db_hashes:
+            return self.db_hashes[db_path]
+
+        # hashing large databases is slow, reuse the stored hash while size and mtime are unchanged
+        stat = os.stat(db_path)
+        row = self.conn.execute("SELECT size, mtime_ns, hash FROM file_hashes WHERE path = ?", (db_path,)).fetchone()
+
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            digest = row[2]
+        else:
+            digest = file_hash(db_path)
+            self.conn.execute("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                              (db_path, stat.st_size, stat.st_mtime_ns, digest))
+            self.conn.commit()
+
+        self.db_hashes[db_path] = digest
+        return digest
+
+    def gold_key(self, dataset:str, db_id:str, db_path:str, gold_sql:str):
+        key = "|".join([dataset, db_id, self.db_hash(db_path), normalize_sql(gold_sql)])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get_gold(self, key:str):
+
+        row = self.conn.execute("SELECT rows FROM gold_results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        return set(pickle.loads(zlib.decompress(row[0])))
+
+    def put_gold(self, key:str, rows:set):
+
+        blob = zlib.compress(pickle.dumps(list(rows), protocol=pickle.HIGHEST_PROTOCOL))
+        if len(blob) > MAX_RESULT_BYTES:
+            return
+
+        self.conn.execute("INSERT OR REPLACE INTO gold_results (key, rows) VALUES (?, ?)", (key, blob))
+        self.conn.commit()
+
+    def score_key(self, dataset:str, db_id:str, db_path:str, pred_sql:str, gold_sql:str):
+        key = "|".join([dataset, db_id, self.db_hash(db_path), canonical_sql(pred_sql), canonical_sql(gold_sql)])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get_scores(self, keys:list):
+
+        scores = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, score, status FROM exec_scores WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            scores.update({key: (score, status) for key, score, status in rows})
+
+        return scores
+
+    def put_scores(self, scores:dict):
+        # scores: key -> (score, status)
+        self.conn.executemany("INSERT OR REPLACE INTO exec_scores (key, score, status) VALUES (?, ?, ?)",
+                              [(key, score, status) for key, (score, status) in scores.items()])
+        self.conn.commit()
+
+
+# keywords upper-cased by canonical_sql, identifiers and literals keep their case
+SQL_KEYWORDS = {
+    "select", "distinct", "from", "where", "and", "or", "not", "in", "is", "null", "like", "between",
+    "exists", "join", "inner", "left", "right", "outer", "cross", "natural", "on", "using", "as",
+    "group", "by", "having", "order", "asc", "desc", "limit", "offset", "union", "all", "intersect",
+    "except", "case", "when", "then", "else", "end", "cast", "count", "sum", "avg", "min", "max",
+    "with", "glob", "escape", "collate", "iif", "coalesce", "ifnull", "nullif", "abs", "round",
+    "length", "substr", "instr", "lower", "upper", "strftime", "date", "datetime", "julianday",
+    "integer", "real", "text", "float",
+}
+
+# functions whose result changes between executions, such queries are never short-circuited
+NONDETERMINISTIC = ("random(", "randomblob(", "current_", "'now'", "changes(", "last_insert_rowid(")
+
+
+def normalize_sql(sql:str, upper_keywords:bool=False):
+
+    # collapses whitespace and removes comments outside of quoted literals and identifiers,
+    # drops trailing semicolons; optionally upper-cases keywords
+    closing = {"'": "'", '"': '"', "`": "`", "[": "]"}
+
+    out = []
+    word = []
+    pending_space = False
+    i = 0
+    n = len(sql)
+
+    def flush_word():
+        if word:
+            w = "".join(word)
+            out.append(w.upper() if upper_keywords and w.lower() in SQL_KEYWORDS else w)
+            word.clear()
+
+    while i < n:
+        ch = sql[i]
+
+        if ch in closing:
+            flush_word()
+            end = sql.find(closing[ch], i + 1)
+            end = n - 1 if end == -1 else end
+            if pending_space and out:
+                out.append(" ")
+            pending_space = False
+            out.append(sql[i:end + 1])
+            i = end + 1
+            continue
+
+        if sql.startswith("--", i) or sql.startswith("/*", i):
+            flush_word()
+            end = sql.find("\n", i) if ch == "-" else sql.find("*/", i + 2)
+            i = n if end == -1 else end + (1 if ch == "-" else 2)
+            pending_space = True
+            continue
+
+        if ch.isspace():
+            flush_word()
+            pending_space = True
+        else:
+            if pending_space and (out or word):
+                flush_word()
+                out.append(" ")
+            pending_space = False
+            if ch.isalnum() or ch == "_":
+                word.append(ch)
+            else:
+                flush_word()
+                out.append(ch)
+        i += 1
+
+    flush_word()
+    return "".join(out).strip().rstrip("; ")
+
+def canonical_sql(sql:str):
+    return normalize_sql(sql, upper_keywords=True)
+
+def is_deterministic(sql:str):
+    lowered = sql.lower()
+    return not any(token in lowered for token in NONDETERMINISTIC)
@@ -1,7 +1,8 @@
 import os
 import time
 import json
-from openai import OpenAI
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 
 TOOL_NAME = "t2sql_tool"
 TOOL = {
@@ -45,36 +46,79 @@ TOOL = {
     }
 }
 
+# connection pool settings shared by all clients of a process
+HTTP_SETTINGS = {
+    "http2": False, # requires the h2 package
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0, # seconds an idle connection is kept open
+}
+
+_CLIENTS = {} # (provider, base_url, is_async) -> client
+
+
 class LLM:
 
-    def __init__(self, provider:str = "openai", model:str = "gpt-5"):
+    def __init__(self, provider:str = "openai", model:str = "gpt-5", base_url:str = None, cache = None):
         self.provider = provider
         self.model = model
+        self.cache = cache # optional ResponseCache
 
-        if self.provider == "openai":
-            self.client = OpenAI(
-                api_key=os.getenv('OPENAI_API_KEY'),
-                organization=os.getenv('OPENAI_API_ORGANIZATION'),
-                project=os.getenv('OPENAI_API_PROJECT'),
-            )
-        elif self.provider == "google":
-            self.client = OpenAI(
-                api_key=os.getenv("GOOGLE_API_KEY"),
-                base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-            )
-        elif self.provider == "together":
-            self.client = OpenAI(
-                api_key=os.getenv("TOGETHERAI_API_KEY"),
-                base_url="https://api.together.xyz/v1"
-            )
+        # clients are shared across instances so connections are kept alive between samples
+        self.client = get_client(self.provider, base_url=base_url)
+        self.async_client = get_client(self.provider, is_async=True, base_url=base_url)
     
     # sending request to llm and receiving response
-    def ask(self, messages):
+    def ask(self, messages, cache_key:str = None):
 
-        tool_to_use = TOOL
+        chat_kwargs = self._build_chat_kwargs(messages, cache_key)
+        cached = self._cache_get(chat_kwargs)
+        if cached:
+            return cached
 
         start_time = time.perf_counter() # start timer
 
+        response = self.client.chat.completions.create(**chat_kwargs)
+
+        end_time = time.perf_counter()  # end timer
+
+        result = self._parse_response(response, duration_seconds=end_time - start_time)
+        self._cache_put(chat_kwargs, result)
+        return result
+
+    # same as ask() but awaitable, used for concurrent prompting
+    async def aask(self, messages, cache_key:str = None):
+
+        chat_kwargs = self._build_chat_kwargs(messages, cache_key)
+        cached = self._cache_get(chat_kwargs)
+        if cached:
+            return cached
+
+        start_time = time.perf_counter() # start timer
+
+        response = await self.async_client.chat.completions.create(**chat_kwargs)
+
+        end_time = time.perf_counter()  # end timer
+
+        result = self._parse_response(response, duration_seconds=end_time - start_time)
+        self._cache_put(chat_kwargs, result)
+        return result
+
+    def _cache_get(self, chat_kwargs):
+        if self.cache is None:
+            return None
+        return self.cache.get(self.cache.make_key(self.provider, chat_kwargs))
+
+    def _cache_put(self, chat_kwargs, result):
+        # responses that could not be deconstructed are not cached, they are requested again next time
+        if self.cache is None or result["response"]["type"] is None:
+            return
+        self.cache.put(self.cache.make_key(self.provider, chat_kwargs), result)
+
+    def _build_chat_kwargs(self, messages, cache_key:str = None):
+
+        tool_to_use = TOOL
+
         chat_kwargs = {
             "model": self.model,
             "messages": messages,
@@ -86,38 +130,114 @@ class LLM:
         # only OpenAI supports reasoning_effort
         if self.provider == "openai":
             chat_kwargs["reasoning_effort"] = "minimal"
+            # routes requests sharing a schema prefix to the same prompt cache
+            if cache_key:
+                chat_kwargs["prompt_cache_key"] = cache_key
 
-        response = self.client.chat.completions.create(**chat_kwargs)
+        return chat_kwargs
 
-        end_time = time.perf_counter()  # end timer
-        duration_seconds = end_time - start_time
+    def _parse_response(self, response, duration_seconds:float):
 
         message = response.choices[0].message
         tool_call = message.tool_calls[0] if message.tool_calls else None
         
-        tool_output = {}
-        try:
-            arguments = json.loads(tool_call.function.arguments)
-            tool_output = {
-                "type": arguments.get("type"),
-                "sql": arguments.get("sql"),
-                "message": arguments.get("message")
-            }
-        except Exception as e:
-            print("Exception when deconstructing response")
-            print(str(tool_call))
-            tool_output = {
-                "type": None,
-                "sql": None,
-                "message": None,
-            }      
+        tool_output = parse_tool_call(tool_call.function.arguments if tool_call else None)
         
         return {
             "response": tool_output,
             "completion_tokens": response.usage.completion_tokens,
             "prompt_tokens": response.usage.prompt_tokens,
+            "cached_tokens": get_cached_tokens(response.usage),
             "total_tokens": response.usage.total_tokens,
             "model": self.model,
             "provider": self.provider,
             "duration_seconds": duration_seconds,
         }
+
+
+def get_client_kwargs(provider:str):
+
+    if provider == "openai":
+        return {
+            "api_key": os.getenv('OPENAI_API_KEY'),
+            "organization": os.getenv('OPENAI_API_ORGANIZATION'),
+            "project": os.getenv('OPENAI_API_PROJECT'),
+        }
+    elif provider == "google":
+        return {
+            "api_key": os.getenv("GOOGLE_API_KEY"),
+            "base_url": "https://generativelanguage.googleapis.com/v1beta/openai/"
+        }
+    elif provider == "together":
+        return {
+            "api_key": os.getenv("TOGETHERAI_API_KEY"),
+            "base_url": "https://api.together.xyz/v1"
+        }
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+
+def parse_tool_call(arguments:str):
+
+    try:
+        arguments = json.loads(arguments)
+        return {
+            "type": arguments.get("type"),
+            "sql": arguments.get("sql"),
+            "message": arguments.get("message")
+        }
+    except Exception as e:
+        print("Exception when deconstructing response")
+        print(str(arguments))
+        return {
+            "type": None,
+            "sql": None,
+            "message": None,
+        }
+
+def get_cached_tokens(usage):
+
+    # prompt tokens served from the provider's prefix cache, usage may be an object or a dict
+    if usage is None:
+        return None
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, "model_dump") else vars(usage)
+
+    details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = details.get("cached_tokens")
+    if cached_tokens is None:
+        cached_tokens = usage.get("cached_tokens") # e.g. together
+    
+    return cached_tokens
+
+def configure_http(**settings):
+
+    unknown = set(settings) - set(HTTP_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown http settings: {unknown}")
+    if _CLIENTS:
+        raise RuntimeError("Configure http settings before the first client is created.")
+
+    HTTP_SETTINGS.update({k: v for k, v in settings.items() if v is not None})
+
+def get_client(provider:str, is_async:bool=False, base_url:str=None):
+
+    client_kwargs = get_client_kwargs(provider)
+    if base_url:
+        client_kwargs["base_url"] = base_url # e.g. a local stand-in server
+    key = (provider, client_kwargs.get("base_url"), is_async)
+
+    if key not in _CLIENTS:
+        limits = httpx.Limits(
+            max_connections=HTTP_SETTINGS["max_connections"],
+            max_keepalive_connections=HTTP_SETTINGS["max_keepalive_connections"],
+            keepalive_expiry=HTTP_SETTINGS["keepalive_expiry"],
+        )
+
+        if is_async:
+            http_client = DefaultAsyncHttpxClient(http2=HTTP_SETTINGS["http2"], limits=limits)
+            _CLIENTS[key] = AsyncOpenAI(**client_kwargs, http_client=http_client)
+        else:
+            http_client = DefaultHttpxClient(http2=HTTP_SETTINGS["http2"], limits=limits)
+            _CLIENTS[key] = OpenAI(**client_kwargs, http_client=http_client)
+
+    return _CLIENTS[key]
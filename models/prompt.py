@@ -18,32 +18,48 @@ INIT_INSTRUCTION = (
 
 class Prompter:
 
-    def __init__(self, provider:str = "openai", model:str = "gpt-5", schema_string:str = None):
+    def __init__(self, provider:str = "openai", model:str = "gpt-5", schema_string:str = None, base_url:str = None,
+                 cache = None):
         self.provider = provider
         self.model = model
-        self.llm = LLM(provider=self.provider, model=self.model)
+        self.llm = LLM(provider=self.provider, model=self.model, base_url=base_url, cache=cache)
 
-        if schema_string:
-            self.schema_string = schema_string
-        else:
-            raise ValueError("Schema string must not be empty!")
+        # default schema, can be overridden per question
+        self.schema_string = schema_string
         
-    def ask_question(self, question):
+    def ask_question(self, question, schema_string:str = None, cache_key:str = None):
 
-        messages = self._build_messages(question)
-        response = self.llm.ask(messages=messages)
+        messages = self._build_messages(question, schema_string)
+        response = self.llm.ask(messages=messages, cache_key=cache_key)
 
         return response
 
+    # cached response of a question or None, lets callers skip rate limiting for cache hits
+    def cached_answer(self, question, schema_string:str = None, cache_key:str = None):
 
-    def _build_messages(self, question):
-        
+        messages = self._build_messages(question, schema_string)
+        return self.llm._cache_get(self.llm._build_chat_kwargs(messages, cache_key))
+
+    async def aask_question(self, question, schema_string:str = None, cache_key:str = None):
+
+        messages = self._build_messages(question, schema_string)
+        response = await self.llm.aask(messages=messages, cache_key=cache_key)
+
+        return response
+
+
+    def _build_messages(self, question, schema_string:str = None):
+
+        schema_string = schema_string or self.schema_string
+        if not schema_string:
+            raise ValueError("Schema string must not be empty!")
+
+        # static content first (instruction, schema) so providers can cache it as a prefix,
+        # only the question at the end changes between requests of the same database
         messages = [
             { "role": "system", "content": INIT_INSTRUCTION },
-            { "role": "system", "content": self.schema_string },
+            { "role": "system", "content": schema_string },
             { "role": "user", "content": question }
         ]
 
         return messages
-
-
@@ -1,13 +1,15 @@
 import os
-import json
 import random
+import hashlib
 from collections import Counter
 
+from utils.json_io import load, dump
 from models.ambiguity_detector import AmbiguityDetector
+from models.schema_store import SchemaStore
 from configs.paths import (
     SPIDER_DEV_PATH, SPIDER_DEV_AUG_PATH, BIRD_DEV_PATH, BIRD_DEV_AUG_PATH,
     TEMP_IMPROPER, SPIDER_TRAIN_PATH, TEMP_AMB_LINGUISTIC, TEMP_AMB_COLUMN,
-    TEMP_AMB_AGGREGATION, TEMP_AMB_SCHEMA, TEMP_AMB_TEMPORAL, SCHEMAS_PATH,
+    TEMP_AMB_AGGREGATION, TEMP_AMB_SCHEMA, TEMP_AMB_TEMPORAL,
     QUESTIONS_PATH
 )
 
@@ -29,8 +31,7 @@ class QuestionGenerator:
             self.aug_path = BIRD_DEV_AUG_PATH
 
         # load questions (only answerable)
-        with open(self.dev_path, "r") as f: 
-            data = json.load(f)
+        data = load(self.dev_path)
 
         self.data = [
             {
@@ -41,9 +42,12 @@ class QuestionGenerator:
             }
             for item in data
         ]
+        self.answerable = list(self.data) # source of unanswerable questions, independent of generated samples
 
         self.distinct_dbs = {item["db_id"] for item in self.data}
+        self.rng = random.Random() # reseeded per database by generate_database
         self.db_schemas = {} # holds all schema representations with table name as key
+        self.schema_store = SchemaStore(dataset=dataset) # packed schemas, falls back to the per-db json files
         self.augmentation_statistics = {} # tracks how many augmented samples were added for each database
 
         # contain templates (only loaded if specific method is called)
@@ -58,18 +62,31 @@ class QuestionGenerator:
 
         # if questions already exist, load them, so they can be used for statistics
         if os.path.exists(f"{QUESTIONS_PATH}questions_{self.dataset}.json"):
-            with open(f"{QUESTIONS_PATH}questions_{self.dataset}.json", "r") as f: 
-                self.data = json.load(f)
+            self.data = load(f"{QUESTIONS_PATH}questions_{self.dataset}.json")
 
     
+    def generate_database(self, db_id:str, seed:int=0):
+
+        # all augmented samples of one database, drawn from a generator seeded by the db_id,
+        # so the result does not depend on the order or process in which databases are generated
+        self.rng = random.Random(db_seed(db_id, seed))
+
+        start = len(self.data)
+        self.generate_improper(db_id)
+        self.generate_unanswerable(db_id)
+        self.generate_ambiguous(db_id)
+
+        samples = self.data[start:]
+        del self.data[start:]
+        return samples
+
     def generate_improper(self, db_id:str=None, n:int=10):
 
         # load improper templates
         if not self.improper_templates:
-            with open(TEMP_IMPROPER, "r") as f: 
-                self.improper_templates = json.load(f)
+            self.improper_templates = load(TEMP_IMPROPER)
 
-        samples = random.sample(self.improper_templates, n)
+        samples = self.rng.sample(self.improper_templates, n)
 
         for sample in samples:
             self.data.append({
@@ -83,25 +100,24 @@ class QuestionGenerator:
 
     def generate_unanswerable(self, db_id:str=None, n:int=20, include_train=True):
         
-        data = self.data
+        data = self.answerable
 
         # load train set (only for spider)
-        if self.dataset == "spider" and include_train and not self.train_set:
-            with open(SPIDER_TRAIN_PATH, "r") as f: 
-                self.train_set = json.load(f)
-                data = self.data + self.train_set
+        if self.dataset == "spider" and include_train:
+            if not self.train_set:
+                self.train_set = load(SPIDER_TRAIN_PATH)
+            data = data + self.train_set
 
         # filter data for allowed samples
-        excluded = EXCLUDED_DATABASES[self.dataset].get(db_id)
-        excluded.append(db_id)
+        excluded = set(EXCLUDED_DATABASES[self.dataset].get(db_id, [])) | {db_id}
 
         filtered_data = [
             item for item in data
-            if not item.get("type") or item.get("type") == "answerable"
+            if (not item.get("type") or item.get("type") == "answerable")
             and item["db_id"] not in excluded
         ]
 
-        samples = random.sample(filtered_data, n)
+        samples = self.rng.sample(filtered_data, n)
 
         for sample in samples:
             self.data.append({
@@ -124,9 +140,8 @@ class QuestionGenerator:
         self._load_ambiguity_templates()
 
         # load schema representation
-        if not hasattr(self.db_schemas, db_id):
-            with open(f"{SCHEMAS_PATH}{self.dataset}/{db_id}.json", "r") as f: 
-                self.db_schemas[db_id] = json.load(f)
+        if db_id not in self.db_schemas:
+            self.db_schemas[db_id] = self.schema_store.get_object(db_id)
 
         # detect ambiguity options
         ag = AmbiguityDetector(self.db_schemas[db_id])
@@ -138,11 +153,11 @@ class QuestionGenerator:
                 
                 coltype = col.get("types")[0]
                 if len(col.get("types")) > 1 or coltype in ["BLOB", "TEXT"]:
-                    samples = random.sample(self.column_ambiguity_templates["nominal"], n)
+                    samples = self.rng.sample(self.column_ambiguity_templates["nominal"], n)
                 elif coltype in ["REAL", "NUMERIC", "INTEGER"]:
-                    samples = random.sample(self.column_ambiguity_templates["numeric"], n)
+                    samples = self.rng.sample(self.column_ambiguity_templates["numeric"], n)
                 elif coltype in ["DATE", "DATETIME"]:
-                    samples = random.sample(self.column_ambiguity_templates["temporal"], n)
+                    samples = self.rng.sample(self.column_ambiguity_templates["temporal"], n)
                 else:
                     raise ValueError(f"Type of Column not found: {col}")
 
@@ -209,11 +224,11 @@ class QuestionGenerator:
                 })
 
         if linguistic:
-            samples = random.sample(self.linguistic_ambiguity_templates, n)
+            samples = self.rng.sample(self.linguistic_ambiguity_templates, n)
             tables = list(self.db_schemas[db_id]["schema"].keys())
 
             for sample in samples:
-                question = sample.replace(PLACEHOLDER, random.choice(tables))
+                question = sample.replace(PLACEHOLDER, self.rng.choice(tables))
                 self.data.append({
                     "db_id": db_id, 
                     "question": question,
@@ -243,8 +258,7 @@ class QuestionGenerator:
             raise ValueError("Generate questions before saving them.")
         
         out_path = f"{QUESTIONS_PATH}questions_{self.dataset}.json"
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, indent=4)
+        dump(self.data, out_path, pretty=True)
         
         print(f"✅ Questions of {self.dataset} saved to {out_path}")
 
@@ -254,7 +268,7 @@ class QuestionGenerator:
     def _generate_ambiguity_questions(self, templates:list, detection_result:list, n:int):
         amb_questions = []
         for tbl in detection_result:
-            samples = random.sample(templates, n)
+            samples = self.rng.sample(templates, n)
             for sample in samples:
                 if tbl.get("table"):
                     amb_questions.append(sample.replace(PLACEHOLDER, tbl.get("table")))
@@ -267,43 +281,42 @@ class QuestionGenerator:
         
         # column ambiguity
         if not self.column_ambiguity_templates:
-            with open(TEMP_AMB_COLUMN, "r") as f: 
-                self.column_ambiguity_templates = json.load(f)
-                print(f"Column Ambiguity (Nominal) Length: {len(self.column_ambiguity_templates['nominal'])}")
-                print(f"Column Ambiguity (Numeric) Length: {len(self.column_ambiguity_templates['numeric'])}")
-                print(f"Column Ambiguity (Temporal) Length: {len(self.column_ambiguity_templates['temporal'])}")
+            self.column_ambiguity_templates = load(TEMP_AMB_COLUMN)
+            print(f"Column Ambiguity (Nominal) Length: {len(self.column_ambiguity_templates['nominal'])}")
+            print(f"Column Ambiguity (Numeric) Length: {len(self.column_ambiguity_templates['numeric'])}")
+            print(f"Column Ambiguity (Temporal) Length: {len(self.column_ambiguity_templates['temporal'])}")
 
         # aggregation ambiguity
         if not self.aggregation_ambiguity_templates:
-            with open(TEMP_AMB_AGGREGATION, "r") as f: 
-                self.aggregation_ambiguity_templates = json.load(f)
-                print(f"Aggregation Ambiguity Length: {len(self.aggregation_ambiguity_templates)}")
+            self.aggregation_ambiguity_templates = load(TEMP_AMB_AGGREGATION)
+            print(f"Aggregation Ambiguity Length: {len(self.aggregation_ambiguity_templates)}")
 
         # linguistic ambiguity
         if not self.linguistic_ambiguity_templates:
-            with open(TEMP_AMB_LINGUISTIC, "r") as f: 
-                self.linguistic_ambiguity_templates = json.load(f)
-                print(f"Linguistic Ambiguity Length: {len(self.linguistic_ambiguity_templates)}")
+            self.linguistic_ambiguity_templates = load(TEMP_AMB_LINGUISTIC)
+            print(f"Linguistic Ambiguity Length: {len(self.linguistic_ambiguity_templates)}")
         
         # schema ambiguity
         if not self.schema_ambiguity_templates:
-            with open(TEMP_AMB_SCHEMA, "r") as f: 
-                self.schema_ambiguity_templates = json.load(f)
-                print(f"Schema Ambiguity Length: {len(self.schema_ambiguity_templates)}")
+            self.schema_ambiguity_templates = load(TEMP_AMB_SCHEMA)
+            print(f"Schema Ambiguity Length: {len(self.schema_ambiguity_templates)}")
                 
         # temporal ambiguity
         if not self.temporal_ambiguity_templates:
-            with open(TEMP_AMB_TEMPORAL, "r") as f: 
-                self.temporal_ambiguity_templates = json.load(f)
-                print(f"Temporal Ambiguity Length: {len(self.temporal_ambiguity_templates)}")
+            self.temporal_ambiguity_templates = load(TEMP_AMB_TEMPORAL)
+            print(f"Temporal Ambiguity Length: {len(self.temporal_ambiguity_templates)}")
 
         # improper templates
-        with open(TEMP_IMPROPER, "r") as f:
-            self.improper_templates = json.load(f)
-            print(f"Improper Length: {len(self.improper_templates)}")
+        self.improper_templates = load(TEMP_IMPROPER)
+        print(f"Improper Length: {len(self.improper_templates)}")
     
         
 
+def db_seed(db_id:str, seed:int=0):
+    # stable across processes and python versions, unlike hash()
+    return int.from_bytes(hashlib.sha256(f"{seed}:{db_id}".encode("utf-8")).digest()[:8], "big")
+
+
 # databases which are excluded when sampling unanswerable questions
 EXCLUDED_DATABASES = {
     "spider": {
@@ -0,0 +1,79 @@
+import time
+import asyncio
+from collections import deque
+
+
+# default budgets per provider (requests per minute, tokens per minute)
+RATE_LIMITS = {
+    "openai": {"rpm": 500, "tpm": 500_000},
+    "google": {"rpm": 150, "tpm": 2_000_000},
+    "together": {"rpm": 600, "tpm": 180_000},
+}
+
+WINDOW_SECONDS = 60
+
+
+class RateLimiter:
+
+    """
+    Sliding window limiter holding the request and token budget of one provider
+    acquire() waits until a request with the estimated token count fits into the window
+    settle() replaces the estimate with the token usage reported by the provider
+    """
+
+    def __init__(self, rpm:int=None, tpm:int=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = deque() # holds [timestamp, tokens] entries of the last minute
+        self.lock = asyncio.Lock()
+
+    def _prune(self, now:float):
+        while self.window and now - self.window[0][0] >= WINDOW_SECONDS:
+            self.window.popleft()
+
+    def _fits(self, tokens:int):
+        if self.rpm and len(self.window) >= self.rpm:
+            return False
+        # a single request larger than the budget is let through once the window is empty
+        if self.tpm and self.window and sum(e[1] for e in self.window) + tokens > self.tpm:
+            return False
+        return True
+
+    async def acquire(self, tokens:int=0):
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+
+                if self._fits(tokens):
+                    entry = [now, tokens]
+                    self.window.append(entry)
+                    return entry
+
+                # wait until the oldest entry leaves the window
+                await asyncio.sleep(max(WINDOW_SECONDS - (now - self.window[0][0]), 0.05))
+
+    def settle(self, entry:list, tokens:int):
+        if tokens is not None:
+            entry[1] = tokens
+
+
+_LIMITERS = {}
+
+def get_rate_limiter(provider:str, rpm:int=None, tpm:int=None):
+
+    # one limiter per provider so budgets are shared across all requests of a run
+    if provider not in _LIMITERS:
+        defaults = RATE_LIMITS.get(provider, {})
+        _LIMITERS[provider] = RateLimiter(
+            rpm=rpm or defaults.get("rpm"),
+            tpm=tpm or defaults.get("tpm")
+        )
+
+    return _LIMITERS[provider]
+
+
+def estimate_tokens(messages:list):
+    # rough estimate of ~4 characters per token, corrected by settle() afterwards
+    return sum(len(m.get("content") or "") for m in messages) // 4
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+from configs.paths import CACHE_PATH
+
+
+CACHE_MODES = ["read", "write", "off"]
+
+
+class ResponseCache:
+
+    """
+    Disk backed cache of parsed llm responses in sqlite
+    Keyed by a hash of the full request payload (provider, model, messages, tool schema)
+    Least recently used entries are evicted once the cache exceeds max_bytes
+
+    modes:  read  - return cached responses, request and store misses
+            write - always request, store responses (refreshes existing entries)
+            off   - no caching
+    """
+
+    def __init__(self, mode:str="read", path:str=None, max_bytes:int=1024 ** 3):
+
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}")
+
+        self.mode = mode
+        self.path = path or f"{CACHE_PATH}responses.sqlite"
+        self.max_bytes = max_bytes
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                accessed REAL NOT NULL
+                             )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed)")
+        self.conn.commit()
+
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def make_key(provider:str, chat_kwargs:dict):
+
+        payload = {k: v for k, v in chat_kwargs.items() if k != "prompt_cache_key"} # routing hint only
+        payload["provider"] = provider
+
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key:str):
+
+        if self.mode != "read":
+            return None
+
+        row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+
+        response = json.loads(row[0])
+        response["from_cache"] = True
+        return response
+
+    def put(self, key:str, response:dict):
+
+        if self.mode == "off":
+            return
+
+        value = json.dumps(response)
+        size = len(value)
+
+        old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if old:
+            self.total_bytes -= old[0]
+
+        self.conn.execute("INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                          (key, value, size, time.time()))
+        self.total_bytes += size
+
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+
+        self.conn.commit()
+
+    def _evict(self):
+
+        # remove least recently used entries until the cache is 10 % below its limit
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall()
+
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
@@ -1,7 +1,33 @@
 import os
-import json
 import sqlite3
 from configs.paths import SCHEMAS_PATH, SPIDER_DATABASE_PATH, BIRD_DATABASE_PATH
+from models.connection_pool import get_connection
+from utils.json_io import load, dump
+from utils.utils import file_hash, count_tokens
+
+
+SCHEMA_VERSION = 1 # bump when the structure of the schema object changes, forces a rebuild
+RENDER_VERSION = 2 # bump when a schema string format changes, invalidates the memoised strings
+SCHEMA_FORMATS = ["default", "ddl", "compact"]
+
+# sqlite keywords (sqlite.org/lang_keywords.html), quoted when used as identifiers
+SQLITE_KEYWORDS = {
+    "abort", "action", "add", "after", "all", "alter", "always", "analyze", "and", "as", "asc", "attach",
+    "autoincrement", "before", "begin", "between", "by", "cascade", "case", "cast", "check", "collate", "column",
+    "commit", "conflict", "constraint", "create", "cross", "current", "current_date", "current_time",
+    "current_timestamp", "database", "default", "deferrable", "deferred", "delete", "desc", "detach", "distinct",
+    "do", "drop", "each", "else", "end", "escape", "except", "exclude", "exclusive", "exists", "explain", "fail",
+    "filter", "first", "following", "for", "foreign", "from", "full", "generated", "glob", "group", "groups",
+    "having", "if", "ignore", "immediate", "in", "index", "indexed", "initially", "inner", "insert", "instead",
+    "intersect", "into", "is", "isnull", "join", "key", "last", "left", "like", "limit", "match", "materialized",
+    "natural", "no", "not", "nothing", "notnull", "null", "nulls", "of", "offset", "on", "or", "order", "others",
+    "outer", "over", "partition", "plan", "pragma", "preceding", "primary", "query", "raise", "range", "recursive",
+    "references", "regexp", "reindex", "release", "rename", "replace", "restrict", "returning", "right", "rollback",
+    "row", "rows", "savepoint", "select", "set", "table", "temp", "temporary", "then", "ties", "to", "transaction",
+    "trigger", "unbounded", "union", "unique", "update", "using", "vacuum", "values", "view", "virtual", "when",
+    "where", "window", "with", "without",
+}
+
 
 class SchemaBuilder:
 
@@ -35,17 +61,15 @@ class SchemaBuilder:
 
     
     
-    #  establish sqlite connection
+    #  establish sqlite connection (read-only, shared through the connection pool)
     def connect(self):
-        self.conn = sqlite3.connect(self.db_path)
+        self.conn = get_connection(self.db_path)
         self.cursor = self.conn.cursor()
 
-    # close sqlite connection
+    # close cursor, the pooled connection stays open for other users in this process
     def close(self):
         if self.cursor:
             self.cursor.close()
-        if self.conn:
-            self.conn.close()
         self.conn = None
         self.cursor = None
 
@@ -76,30 +100,6 @@ class SchemaBuilder:
         if tables:
             self.tables = [table["name"] for table in tables]
         
-    def _get_primary_keys(self):
-
-        self.primary_keys = {} # reset primary keys
-        if len(self.tables) == 0:
-            raise ValueError("Tables must not be empty for primary key extraction.")
-        
-        pks = {}
-
-        for table in self.tables:
-            try:
-                sql = f"PRAGMA table_info([{table}])"
-                self.cursor.execute(sql)
-                info = to_dict(cursor=self.cursor)
-                
-                for row in info:
-                    if row.get("pk") > 0:
-                        pks.setdefault(table, []).append(row.get("name"))
-            except Exception as e:
-                print(f"db_id: {self.db_id}")
-                print(f"current table: {table}")
-                raise Exception(e)
-        
-        self.primary_keys = pks
-
     def _get_foreign_keys(self):
         
         self.foreign_keys = {} # reset foreign keys
@@ -124,16 +124,24 @@ class SchemaBuilder:
 
     def _get_columns(self):
 
+        # columns and primary keys come from the same table_info pass
         self.columns = {} # reset columns
+        self.primary_keys = {} # reset primary keys
         if len(self.tables) == 0:
             raise ValueError("Tables must not be empty for column extraction.")        
 
         cols = {}
+        pks = {}
 
         for table in self.tables:
-            sql = f"PRAGMA table_info([{table}])"
-            self.cursor.execute(sql)
-            info = to_dict(cursor=self.cursor)
+            try:
+                sql = f"PRAGMA table_info([{table}])"
+                self.cursor.execute(sql)
+                info = to_dict(cursor=self.cursor)
+            except Exception as e:
+                print(f"db_id: {self.db_id}")
+                print(f"current table: {table}")
+                raise Exception(e)
             
             for row in info:
                 cols.setdefault(table, []).append({"name": row.get("name"),
@@ -141,14 +149,16 @@ class SchemaBuilder:
                                                     "typegroup": normalize_type(row.get("type")),
                                                     "notnull": bool(row.get("notnull")),
                                                     "pk": row.get("pk")})
+                if row.get("pk") > 0:
+                    pks.setdefault(table, []).append(row.get("name"))
         
         self.columns = cols
+        self.primary_keys = pks
     
     def build_schema_object(self):
         self._get_tables()
-        self._get_primary_keys()
-        self._get_foreign_keys()
         self._get_columns()
+        self._get_foreign_keys()
 
         obj = {"dataset": self.dataset, "db_id": self.db_id, "schema": {}}
         for table in self.tables:
@@ -157,19 +167,57 @@ class SchemaBuilder:
                 "primary_keys": self.primary_keys.get(table, []),
                 "foreign_keys": self.foreign_keys.get(table, [])
             }
+        obj["fingerprint"] = self.fingerprint()
         self.schema_object = obj
         return obj
 
+    # identifies the database file a schema was built from
+    def fingerprint(self, content_hash:str=None):
+        stat = os.stat(self.db_path)
+        return {
+            "version": SCHEMA_VERSION,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": content_hash or file_hash(self.db_path)
+        }
+
+    # true if the saved schema was built from the current database file
+    def is_up_to_date(self):
+
+        path = f"{SCHEMAS_PATH}{self.dataset}/{self.db_id}.json"
+        if not os.path.exists(path):
+            return False
+
+        stored_object = load(path)
+        stored = stored_object.get("fingerprint")
+        if not stored or stored.get("version") != SCHEMA_VERSION:
+            return False
+
+        # size and mtime unchanged, no need to hash the file
+        stat = os.stat(self.db_path)
+        if stored["size"] == stat.st_size and stored["mtime_ns"] == stat.st_mtime_ns:
+            return True
+
+        # file touched, compare the content
+        if stored["size"] != stat.st_size or stored["sha256"] != file_hash(self.db_path):
+            return False
+
+        # same content, store the new mtime so the next check is cheap again
+        stored_object["fingerprint"] = self.fingerprint(content_hash=stored["sha256"])
+        self.schema_object = stored_object
+        self.save_schema_json(verbose=False)
+        return True
+
     # save schema object as json
-    def save_schema_json(self):
+    def save_schema_json(self, verbose:bool=True):
         if not self.schema_object:
             raise ValueError("Build schema before saving it.")
         
         out_path = f"{SCHEMAS_PATH}{self.dataset}/{self.db_id}.json"
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(self.schema_object, f, indent=4)
+        dump(self.schema_object, out_path, pretty=True)
         
-        print(f"✅ Schema saved to {out_path}")
+        if verbose:
+            print(f"✅ Schema saved to {out_path}")
 
     # load schema object from json
     def load_schema_json(self, repopulate_attributes=True):
@@ -179,8 +227,7 @@ class SchemaBuilder:
         if not os.path.exists(path):
             raise FileNotFoundError(f"No schema file found at {path}")
 
-        with open(path, "r", encoding="utf-8") as f:
-            self.schema_object = json.load(f)
+        self.schema_object = load(path)
 
         if repopulate_attributes:
             self.tables = list(self.schema_object.keys())
@@ -190,47 +237,146 @@ class SchemaBuilder:
 
         return self.schema_object
     
-    def generate_schema_string(self):
+    def generate_schema_string(self, fmt:str="default"):
+        return self.get_rendering(fmt)["string"]
+
+    # rendered schema string and its token count, memoised on disk per schema fingerprint
+    def get_rendering(self, fmt:str="default"):
 
         if not self.schema_object:
             raise RuntimeError("Schema object is not populated!")
-        
-        foreign_keys = []
 
-        # db_id
-        schema_string = f"## Database Name: {self.schema_object['db_id']} \n\n"
+        fingerprint = self.schema_object.get("fingerprint")
+        if fingerprint is None: # schema saved before fingerprints were recorded
+            return render(self.schema_object, fmt)
 
-        # schema
-        schema_string += "## Database Schema \n\n"
+        key = f"{fingerprint['sha256']}-{fingerprint['version']}-{RENDER_VERSION}"
+        path = f"{SCHEMAS_PATH}{self.dataset}/strings/{self.db_id}.json"
 
-        # tables with columns
-        for table_name, table_object in self.schema_object["schema"].items():
+        memo = load(path) if os.path.exists(path) else {}
+        if memo.get("key") != key:
+            memo = {"key": key, "formats": {}}
 
-            schema_string += f"# Table: {table_name}\n[\n"
-            
-            for column_object in table_object["columns"]:
-                schema_string += f"({column_object['name']}: {column_object['type'].upper()},"
-                if column_object['pk'] == 1:
-                    schema_string += " PRIMARY KEY,"
-                if not column_object['notnull']:
-                    schema_string += " NOT NULL"                
-                schema_string += "),\n"
-            schema_string += "]\n\n"
-
-            for fk in table_object.get("foreign_keys", []):
-                # foreign key column on this table
-                fk_identifier = f"{table_name}.{fk['targetColumn']}"
-                # PK it references:
-                pk_identifier = f"{fk['sourceTable']}.{fk['sourceColumn']}"
-                foreign_keys.append((fk_identifier, pk_identifier))
+        if fmt not in memo["formats"]:
+            memo["formats"][fmt] = render(self.schema_object, fmt)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            dump(memo, path)
+
+        return memo["formats"][fmt]
+
+
+# rendering
+
+def render(schema_object:dict, fmt:str="default"):
+    schema_string = render_schema_string(schema_object, fmt)
+    return {"string": schema_string, "tokens": count_tokens(schema_string)}
+
+def render_schema_string(schema_object:dict, fmt:str="default"):
+
+    if fmt == "default":
+        return _render_default(schema_object)
+    elif fmt == "ddl":
+        return _render_ddl(schema_object)
+    elif fmt == "compact":
+        return _render_compact(schema_object)
+    else:
+        raise ValueError(f"Unknown schema format: {fmt}")
+
+def _render_default(schema_object:dict):
+
+    # format of the paper's experiments, kept byte for byte
+    foreign_keys = []
+
+    # db_id
+    parts = [f"## Database Name: {schema_object['db_id']} \n\n"]
+
+    # schema
+    parts.append("## Database Schema \n\n")
+
+    # tables with columns
+    for table_name, table_object in schema_object["schema"].items():
+
+        parts.append(f"# Table: {table_name}\n[\n")
         
-        # foreign keys
-        if foreign_keys:
-            schema_string += "## Foreign Keys \n"
-            for fk_identifier, pk_identifier in foreign_keys:
-                schema_string += f"{fk_identifier} REFERENCES {pk_identifier}\n"
+        for column_object in table_object["columns"]:
+            parts.append(f"({column_object['name']}: {column_object['type'].upper()},")
+            if column_object['pk'] == 1:
+                parts.append(" PRIMARY KEY,")
+            if not column_object['notnull']:
+                parts.append(" NOT NULL")
+            parts.append("),\n")
+        parts.append("]\n\n")
+
+        for fk in table_object.get("foreign_keys", []):
+            # foreign key column on this table
+            fk_identifier = f"{table_name}.{fk['targetColumn']}"
+            # PK it references:
+            pk_identifier = f"{fk['sourceTable']}.{fk['sourceColumn']}"
+            foreign_keys.append((fk_identifier, pk_identifier))
+    
+    # foreign keys
+    if foreign_keys:
+        parts.append("## Foreign Keys \n")
+        for fk_identifier, pk_identifier in foreign_keys:
+            parts.append(f"{fk_identifier} REFERENCES {pk_identifier}\n")
+
+    return "".join(parts)
+
+def _render_ddl(schema_object:dict):
+
+    # one CREATE TABLE statement per line
+    lines = [f"-- Database: {schema_object['db_id']}"]
+
+    for table_name, table_object in schema_object["schema"].items():
+        definitions = []
+        for column_object in table_object["columns"]:
+            definition = " ".join(filter(None, [quote_identifier(column_object["name"]), column_object["type"].upper()]))
+            if column_object["notnull"]:
+                definition += " NOT NULL"
+            definitions.append(definition)
+
+        if table_object.get("primary_keys"):
+            definitions.append(f"PRIMARY KEY ({', '.join(quote_identifier(pk) for pk in table_object['primary_keys'])})")
+
+        for fk in table_object.get("foreign_keys", []):
+            reference = quote_identifier(fk["sourceTable"])
+            if fk["sourceColumn"]:
+                reference += f"({quote_identifier(fk['sourceColumn'])})"
+            definitions.append(f"FOREIGN KEY ({quote_identifier(fk['targetColumn'])}) REFERENCES {reference}")
+
+        lines.append(f"CREATE TABLE {quote_identifier(table_name)} ({', '.join(definitions)});")
+
+    return "\n".join(lines) + "\n"
+
+def _render_compact(schema_object:dict):
+
+    # one line per table: table(column TYPE pk, column TYPE -> table.column, ...)
+    lines = [f"# Database: {schema_object['db_id']}"]
+
+    for table_name, table_object in schema_object["schema"].items():
+        references = {fk["targetColumn"]: fk for fk in table_object.get("foreign_keys", [])}
+
+        columns = []
+        for column_object in table_object["columns"]:
+            column = " ".join(filter(None, [quote_identifier(column_object["name"]), column_object["type"].upper()]))
+            if column_object["name"] in table_object.get("primary_keys", []):
+                column += " pk"
+            fk = references.get(column_object["name"])
+            if fk:
+                column += f" -> {quote_identifier(fk['sourceTable'])}"
+                if fk["sourceColumn"]:
+                    column += f".{quote_identifier(fk['sourceColumn'])}"
+            columns.append(column)
+
+        lines.append(f"{quote_identifier(table_name)}({', '.join(columns)})")
+
+    return "\n".join(lines) + "\n"
 
-        return schema_string
+def quote_identifier(name:str):
+    # identifiers with spaces or special characters (common in BIRD) and keywords are quoted as in sqlite
+    if name and name.replace("_", "").isalnum() and not name[0].isdigit() and name.lower() not in SQLITE_KEYWORDS:
+        return name
+    return '"' + name.replace('"', '""') + '"'
 
 
 # utilities
@@ -0,0 +1,153 @@
+import re
+import math
+from collections import deque
+
+from models.schema_builder import render
+
+
+# words that never identify a table or column
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "at", "to", "for", "by", "with", "from", "and", "or", "not", "is", "are",
+    "was", "were", "be", "been", "what", "which", "who", "whom", "whose", "when", "where", "how", "many", "much",
+    "list", "show", "give", "find", "return", "all", "each", "every", "that", "this", "these", "those", "than",
+    "there", "their", "its", "it", "do", "does", "did", "has", "have", "had", "me", "please", "name", "id",
+}
+
+TABLE_WEIGHT = 2.0 # a question word matching the table name counts more than a column match
+
+
+class SchemaLinker:
+
+    """
+    Selects the tables of a schema object that are relevant for a question
+    Tables are ranked lexically by idf-weighted overlap of question words with table and column names,
+    tables joining the selected ones and, transitively, all tables they reference via foreign keys are added,
+    so every join path and foreign key in the pruned schema stays valid
+    """
+
+    def __init__(self, schema_object:dict, top_k:int=4):
+
+        self.schema_object = schema_object
+        self.top_k = top_k
+        self.tables = list(schema_object["schema"].keys())
+
+        # sqlite names are case-insensitive, foreign keys may spell tables differently
+        self.lookup = {table.lower(): table for table in self.tables}
+
+        self.table_words = {table: tokenize(table) for table in self.tables}
+        self.column_words = {
+            table: set().union(*[tokenize(column["name"]) for column in meta["columns"]])
+            for table, meta in schema_object["schema"].items()
+        }
+
+        # inverse document frequency of every word over the tables
+        n = len(self.tables)
+        frequency = {}
+        for table in self.tables:
+            for word in self.table_words[table] | self.column_words[table]:
+                frequency[word] = frequency.get(word, 0) + 1
+        self.idf = {word: math.log(1 + n / count) for word, count in frequency.items()}
+
+        # parents: tables referenced by a table, neighbours: undirected foreign key graph
+        self.parents = {table: set() for table in self.tables}
+        self.neighbours = {table: set() for table in self.tables}
+        for table, meta in schema_object["schema"].items():
+            for fk in meta.get("foreign_keys", []):
+                source = self.lookup.get((fk.get("sourceTable") or "").lower())
+                if source and source != table:
+                    self.parents[table].add(source)
+                    self.neighbours[table].add(source)
+                    self.neighbours[source].add(table)
+
+        self.renderings = {} # (kept tables, fmt) -> rendering
+
+    def rank(self, question:str):
+
+        # returns [(table, score)] sorted by score, tables without any match are left out
+        words = tokenize(question)
+        scores = []
+        for table in self.tables:
+            score = sum(TABLE_WEIGHT * self.idf[w] for w in words & self.table_words[table])
+            score += sum(self.idf[w] for w in words & (self.column_words[table] - self.table_words[table]))
+            if score > 0:
+                scores.append((table, score))
+
+        return sorted(scores, key=lambda item: -item[1])
+
+    def select(self, question:str):
+
+        ranked = self.rank(question)
+        if not ranked:
+            return list(self.tables) # nothing to go by, keep the full schema
+
+        selected = [table for table, _ in ranked[:self.top_k]]
+        kept = set(selected)
+
+        # bridge tables on the shortest join path between the selected tables
+        for table in selected[1:]:
+            kept.update(self._path(selected[0], table))
+
+        # referenced tables up to the closure, so that every foreign key of a kept table points to a kept table
+        frontier = list(kept)
+        while frontier:
+            table = frontier.pop()
+            for parent in self.parents[table] - kept:
+                kept.add(parent)
+                frontier.append(parent)
+
+        return [table for table in self.tables if table in kept]
+
+    def _path(self, start:str, goal:str):
+
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            table = queue.popleft()
+            if table == goal:
+                path = []
+                while table is not None:
+                    path.append(table)
+                    table = previous[table]
+                return path
+            for neighbour in self.neighbours[table]:
+                if neighbour not in previous:
+                    previous[neighbour] = table
+                    queue.append(neighbour)
+
+        return [] # not connected, the tables are kept without a bridge
+
+    def prune(self, tables:list):
+
+        kept = set(tables)
+        schema = {}
+        for table in tables:
+            meta = self.schema_object["schema"][table]
+            schema[table] = dict(meta, foreign_keys=[
+                fk for fk in meta.get("foreign_keys", [])
+                if self.lookup.get((fk.get("sourceTable") or "").lower()) in kept
+            ])
+
+        return {"dataset": self.schema_object.get("dataset"), "db_id": self.schema_object["db_id"], "schema": schema}
+
+    def get_rendering(self, question:str, fmt:str="default"):
+
+        # schema string restricted to the selected tables, identical selections are rendered once
+        tables = tuple(self.select(question))
+        if (tables, fmt) not in self.renderings:
+            self.renderings[(tables, fmt)] = render(self.prune(list(tables)), fmt)
+
+        return self.renderings[(tables, fmt)]
+
+
+def tokenize(text:str):
+
+    # splits snake_case, camelCase and spaces into lower-case words, drops plural s
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    words = set()
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        if word not in STOPWORDS:
+            words.add(word)
+
+    return words
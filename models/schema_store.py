@@ -0,0 +1,214 @@
+import os
+import mmap
+import struct
+
+from configs.paths import SCHEMAS_PATH
+from models.schema_builder import SchemaBuilder, SCHEMA_FORMATS, RENDER_VERSION
+from utils.json_io import load, loads, dumps
+
+
+MAGIC = b"FSQLPACK"
+PACK_VERSION = 3
+HEADER = struct.Struct("<8sIQQ") # magic, version, index offset, index length
+
+
+class SchemaStore:
+
+    """
+    Packed schema objects and schema strings (all formats) of one dataset in data/schemas/<dataset>.pack
+    The file is memory-mapped, entries are located via an offset index and parsed on first access
+    Databases missing from the pack, or whose json file was rebuilt since packing, are loaded from their json file instead
+    """
+
+    def __init__(self, dataset:str="spider", path:str=None):
+
+        self.dataset = dataset
+        self.path = path or f"{SCHEMAS_PATH}{dataset}.pack"
+
+        # db_id -> {"object": [offset, length], "strings": {fmt: [offset, length]}, "tokens": {fmt: n},
+        #           "fingerprint": schema fingerprint, "json": [size, mtime_ns] of the packed json file}
+        self.index = {}
+        self.checked = set() # databases whose pack entry was compared with the json file
+        self.stale = set() # databases whose json file changed since packing
+        self.objects = {} # parsed schema objects
+        self.renderings = {} # (db_id, fmt) -> {"string": ..., "tokens": ...}
+        self.builders = {} # schema builders of databases missing in the pack
+
+        self._file = None
+        self._mmap = None
+        if os.path.exists(self.path):
+            self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, db_id:str):
+        return db_id in self.index or os.path.exists(self._json_path(db_id))
+
+    def _open(self):
+
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, index_offset, index_length = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != PACK_VERSION:
+            self.close()
+            print(f"Ignoring {self.path}, unknown pack format.")
+            return
+
+        index = loads(self._mmap[index_offset:index_offset + index_length])
+        if index["render_version"] != RENDER_VERSION:
+            self.close()
+            print(f"Ignoring {self.path}, schema strings were rendered by an older version.")
+            return
+
+        self.index = index["databases"]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+        self._mmap = None
+        self._file = None
+        self.index = {}
+
+    def _json_path(self, db_id:str):
+        return f"{SCHEMAS_PATH}{self.dataset}/{db_id}.json"
+
+    def _builder(self, db_id:str):
+        if db_id not in self.builders:
+            sb = SchemaBuilder(dataset=self.dataset, db_id=db_id)
+            sb.load_schema_json()
+            self.builders[db_id] = sb
+        return self.builders[db_id]
+
+    def _entry(self, db_id:str):
+
+        # pack entry of a database, None if it is not packed or its json file was rebuilt since
+        if db_id not in self.index:
+            return None
+
+        if db_id not in self.checked:
+            self.checked.add(db_id)
+            entry = self.index[db_id]
+            path = self._json_path(db_id)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                if entry["json"] != [stat.st_size, stat.st_mtime_ns]:
+                    # json rewritten, it is still current if it describes the same database content
+                    stored = load(path).get("fingerprint") or {}
+                    packed = entry["fingerprint"] or {}
+                    if (stored.get("sha256"), stored.get("version")) != (packed.get("sha256"), packed.get("version")):
+                        self.stale.add(db_id)
+
+        return None if db_id in self.stale else self.index[db_id]
+
+    def get_object(self, db_id:str):
+
+        if db_id not in self.objects:
+            entry = self._entry(db_id)
+            if entry is not None:
+                offset, length = entry["object"]
+                self.objects[db_id] = loads(self._mmap[offset:offset + length])
+            else:
+                self.objects[db_id] = self._builder(db_id).schema_object
+
+        return self.objects[db_id]
+
+    def get_rendering(self, db_id:str, fmt:str="default"):
+
+        if (db_id, fmt) not in self.renderings:
+            entry = self._entry(db_id)
+            if entry is not None and fmt in entry["strings"]:
+                offset, length = entry["strings"][fmt]
+                self.renderings[(db_id, fmt)] = {
+                    "string": self._mmap[offset:offset + length].decode("utf-8"),
+                    "tokens": entry["tokens"][fmt]
+                }
+            else:
+                self.renderings[(db_id, fmt)] = self._builder(db_id).get_rendering(fmt)
+
+        return self.renderings[(db_id, fmt)]
+
+    def get_string(self, db_id:str, fmt:str="default"):
+        return self.get_rendering(db_id, fmt)["string"]
+
+    def get_tokens(self, db_id:str, fmt:str="default"):
+        # token count of the schema string (tiktoken or estimate, see utils.count_tokens)
+        entry = self._entry(db_id)
+        if entry is not None and fmt in entry["tokens"]:
+            return entry["tokens"][fmt]
+        return self.get_rendering(db_id, fmt)["tokens"]
+
+    def db_ids(self):
+        return sorted(self.index)
+
+
+def _json_db_ids(dataset:str):
+    schema_dir = f"{SCHEMAS_PATH}{dataset}/"
+    return sorted(name[:-len(".json")] for name in os.listdir(schema_dir) if name.endswith(".json"))
+
+
+def pack_is_current(dataset:str, path:str=None):
+
+    # true if the pack holds exactly the current json files of the dataset in every format
+    with SchemaStore(dataset=dataset, path=path) as store:
+        if sorted(store.index) != _json_db_ids(dataset):
+            return False
+
+        for db_id, entry in store.index.items():
+            stat = os.stat(store._json_path(db_id))
+            if entry["json"] != [stat.st_size, stat.st_mtime_ns] or sorted(entry["strings"]) != sorted(SCHEMA_FORMATS):
+                return False
+
+    return True
+
+
+def write_pack(dataset:str, path:str=None):
+
+    # packs all per-db schema json files of a dataset together with their schema strings in every format
+    path = path or f"{SCHEMAS_PATH}{dataset}.pack"
+    schema_dir = f"{SCHEMAS_PATH}{dataset}/"
+    db_ids = _json_db_ids(dataset)
+
+    index = {}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+
+        for db_id in db_ids:
+            # stat before reading, a json rewritten meanwhile is detected as changed
+            stat = os.stat(f"{schema_dir}{db_id}.json")
+            sb = SchemaBuilder(dataset=dataset, db_id=db_id)
+            schema_object = sb.load_schema_json()
+            object_bytes = dumps(schema_object).encode("utf-8")
+
+            entry = {
+                "object": [f.tell(), len(object_bytes)], "strings": {}, "tokens": {},
+                "fingerprint": schema_object.get("fingerprint"), "json": [stat.st_size, stat.st_mtime_ns]
+            }
+            f.write(object_bytes)
+
+            for fmt in SCHEMA_FORMATS:
+                rendering = sb.get_rendering(fmt)
+                string_bytes = rendering["string"].encode("utf-8")
+                entry["strings"][fmt] = [f.tell(), len(string_bytes)]
+                entry["tokens"][fmt] = rendering["tokens"]
+                f.write(string_bytes)
+
+            index[db_id] = entry
+
+        index_bytes = dumps({"render_version": RENDER_VERSION, "databases": index}).encode("utf-8")
+        index_offset = f.tell()
+        f.write(index_bytes)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, PACK_VERSION, index_offset, len(index_bytes)))
+
+    # readers never see a half written pack
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,238 @@
+import os
+import time
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+from external.testsuitesqleval.exec_eval import eval_exec_match
+from models.exec_cache import ExecutionCache, canonical_sql, is_deterministic
+from models.connection_pool import get_connection
+
+
+BIRD_TIMEOUT = 30 # wall-clock seconds per query, the predicted and the gold query each get their own
+PROGRESS_STEPS = 10_000 # sqlite vm instructions between two timeout checks
+
+# execution status recorded next to the score
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_TIMEOUT = "timeout"
+STATUS_GOLD_MATCH = "gold_match" # prediction identical to gold, only the gold query executed
+STATUS_EMPTY = "empty" # no sql predicted
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+_EXEC_CACHE = None
+_EXEC_CACHE_PID = None
+_SESSION_SCORES = {} # (dataset, db_id, canonical pred, canonical gold) -> (score, status), per process
+
+def get_exec_cache():
+
+    global _EXEC_CACHE, _EXEC_CACHE_PID
+
+    # sqlite connections must not be used across fork, workers open their own
+    if _EXEC_CACHE is None or _EXEC_CACHE_PID != os.getpid():
+        _EXEC_CACHE = ExecutionCache()
+        _EXEC_CACHE_PID = os.getpid()
+
+    return _EXEC_CACHE
+
+
+def run_query(conn:sqlite3.Connection, sql:str, deadline:float, max_instructions:int=None):
+
+    # sqlite calls the handler every PROGRESS_STEPS instructions, a non-zero return aborts the query
+    steps = [0]
+    def handler():
+        steps[0] += PROGRESS_STEPS
+        if max_instructions and steps[0] > max_instructions:
+            return 1
+        return 1 if time.monotonic() > deadline else 0
+
+    conn.set_progress_handler(handler, PROGRESS_STEPS)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql)
+        return cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        if "interrupted" in str(e):
+            raise QueryTimeout(sql)
+        raise
+    finally:
+        cursor.close()
+        conn.set_progress_handler(None, PROGRESS_STEPS)
+
+
+def bird_exec_match(db_path:str, pred_sql:str, gold_sql:str, gold_key:str=None,
+                    timeout:float=BIRD_TIMEOUT, max_instructions:int=None):
+
+    # same comparison as execute_sql of the BIRD evaluation, but on a warm connection, cancelled
+    # cooperatively once the budget is used up, and with the gold result set taken from the cache
+    # each query has its own budget, so the score does not depend on whether the gold result was cached
+    conn = get_connection(db_path)
+
+    predicted_res = run_query(conn, pred_sql, time.monotonic() + timeout, max_instructions)
+
+    ground_truth_res = get_exec_cache().get_gold(gold_key) if gold_key else None
+    if ground_truth_res is None:
+        ground_truth_res = set(run_query(conn, gold_sql, time.monotonic() + timeout, max_instructions))
+        if gold_key:
+            get_exec_cache().put_gold(gold_key, ground_truth_res)
+
+    return 1 if set(predicted_res) == ground_truth_res else 0
+
+
+def run_gold(db_path:str, gold_sql:str, gold_key:str=None, timeout:float=BIRD_TIMEOUT, max_instructions:int=None):
+
+    # executes the gold query alone (or finds its result in the cache), raises like run_query if it fails
+    if gold_key and get_exec_cache().get_gold(gold_key) is not None:
+        return
+
+    ground_truth_res = set(run_query(get_connection(db_path), gold_sql, time.monotonic() + timeout, max_instructions))
+    if gold_key:
+        get_exec_cache().put_gold(gold_key, ground_truth_res)
+
+
+def execute_job(dataset:str, db_path:str, pred_sql:str, gold_sql:str, db_id:str=None, use_cache:bool=False,
+                timeout:float=BIRD_TIMEOUT, max_instructions:int=None):
+
+    # returns (score, status)
+    if pred_sql is None or pred_sql == "":
+        return 0, STATUS_EMPTY
+
+    # prediction equals gold, the same query on the same database matches if the gold query runs at all
+    if dataset in ("spider", "bird") and canonical_sql(pred_sql) == canonical_sql(gold_sql) and is_deterministic(gold_sql):
+        gold_key = get_exec_cache().gold_key(dataset, db_id, db_path, gold_sql) if use_cache and dataset == "bird" else None
+        try:
+            run_gold(db_path, gold_sql, gold_key, timeout=timeout, max_instructions=max_instructions)
+            return 1, STATUS_GOLD_MATCH
+        except QueryTimeout:
+            return 0, STATUS_TIMEOUT
+        except Exception:
+            return 0, STATUS_ERROR
+
+    if dataset == "spider":
+        # test-suite evaluation compares on several database variants and handles timeouts itself,
+        # gold results are not cached
+        score = eval_exec_match(db=db_path, p_str=pred_sql, g_str=gold_sql, plug_value=False,
+                                keep_distinct=True, progress_bar_for_each_datapoint=False)
+        return score, STATUS_OK
+    elif dataset == "bird":
+        gold_key = get_exec_cache().gold_key(dataset, db_id, db_path, gold_sql) if use_cache else None
+        try:
+            return bird_exec_match(db_path, pred_sql, gold_sql, gold_key,
+                                   timeout=timeout, max_instructions=max_instructions), STATUS_OK
+        except QueryTimeout:
+            return 0, STATUS_TIMEOUT
+        except Exception:
+            return 0, STATUS_ERROR
+    else:
+        raise Exception("Uknown dataset during evaluation.")
+
+
+def execute_database(dataset:str, db_id:str, db_path:str, jobs:list, use_cache:bool=False,
+                  timeout:float=BIRD_TIMEOUT, max_instructions:int=None):
+    # jobs: list of (key, pred_sql, gold_sql) of the same database
+    return [
+        (key, execute_job(dataset, db_path, pred_sql, gold_sql, db_id=db_id, use_cache=use_cache,
+                          timeout=timeout, max_instructions=max_instructions))
+        for key, pred_sql, gold_sql in jobs
+    ]
+
+
+def execute_all(dataset:str, db_root:str, jobs:list, workers:int=1, use_cache:bool=True,
+                timeout:float=BIRD_TIMEOUT, max_instructions:int=None, executor:ProcessPoolExecutor=None):
+
+    """
+    jobs: list of (position, db_id, pred_sql, gold_sql)
+    returns {position: (score, status)}, independent of the number of workers
+    executor: optional pool reused across calls, otherwise one is started for this call if workers > 1
+    identical (db_id, pred, gold) triples after canonicalisation are executed only once
+    """
+
+    cache = get_exec_cache() if use_cache else None
+
+    scores = {}
+    unique = {} # memo key -> (db_id, pred_sql, gold_sql) of the first occurrence
+    positions = {} # memo key -> positions sharing it
+
+    for position, db_id, pred_sql, gold_sql in jobs:
+        if pred_sql is None or pred_sql == "":
+            scores[position] = (0, STATUS_EMPTY)
+            continue
+
+        # predictions equal to gold are memoised too, execute_job only runs their gold query
+        key = (dataset, db_id, canonical_sql(pred_sql), canonical_sql(gold_sql))
+        unique.setdefault(key, (db_id, pred_sql, gold_sql))
+        positions.setdefault(key, []).append(position)
+
+    # scores known from this session or from previous sessions on disk
+    memo = {key: _SESSION_SCORES[key] for key in unique if key in _SESSION_SCORES}
+    disk_keys = {}
+    if cache:
+        disk_keys = {
+            key: cache.score_key(dataset, db_id, f"{db_root}{db_id}/{db_id}.sqlite", pred_sql, gold_sql)
+            for key, (db_id, pred_sql, gold_sql) in unique.items() if key not in memo
+        }
+        stored = cache.get_scores(list(disk_keys.values()))
+        memo.update({key: stored[disk_key] for key, disk_key in disk_keys.items() if disk_key in stored})
+
+    pending = [(key, db_id, pred_sql, gold_sql) for key, (db_id, pred_sql, gold_sql) in unique.items() if key not in memo]
+    executed = _execute_pending(dataset, db_root, pending, workers, use_cache, timeout, max_instructions, executor)
+
+    # timeouts depend on machine load, they are executed again next time
+    if cache:
+        cache.put_scores({disk_keys[key]: result for key, result in executed.items() if result[1] != STATUS_TIMEOUT})
+
+    memo.update(executed)
+    _SESSION_SCORES.update({key: result for key, result in memo.items() if result[1] != STATUS_TIMEOUT})
+
+    for key, key_positions in positions.items():
+        for position in key_positions:
+            scores[position] = memo[key]
+
+    return scores
+
+
+def _execute_pending(dataset:str, db_root:str, jobs:list, workers:int, use_cache:bool,
+                     timeout:float, max_instructions:int, executor:ProcessPoolExecutor=None):
+
+    # one task per database, so each database is opened and warmed up by a single worker
+    groups = {}
+    for key, db_id, pred_sql, gold_sql in jobs:
+        groups.setdefault(db_id, []).append((key, pred_sql, gold_sql))
+
+    # largest databases first, the small ones fill the gaps at the end
+    tasks = [
+        (db_id, f"{db_root}{db_id}/{db_id}.sqlite", db_jobs)
+        for db_id, db_jobs in sorted(groups.items(), key=lambda item: -len(item[1]))
+    ]
+
+    scores = {}
+    progress = tqdm(total=len(jobs), desc="Executing SQL")
+
+    if executor is not None:
+        _submit_all(executor, dataset, tasks, use_cache, timeout, max_instructions, scores, progress)
+    elif workers <= 1:
+        for db_id, db_path, db_jobs in tasks:
+            scores.update(execute_database(dataset, db_id, db_path, db_jobs, use_cache, timeout, max_instructions))
+            progress.update(len(db_jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            _submit_all(executor, dataset, tasks, use_cache, timeout, max_instructions, scores, progress)
+
+    progress.close()
+    return scores
+
+
+def _submit_all(executor:ProcessPoolExecutor, dataset:str, tasks:list, use_cache:bool, timeout:float,
+                max_instructions:int, scores:dict, progress):
+
+    futures = {
+        executor.submit(execute_database, dataset, db_id, db_path, db_jobs, use_cache, timeout, max_instructions): len(db_jobs)
+        for db_id, db_path, db_jobs in tasks
+    }
+    for future in as_completed(futures):
+        scores.update(future.result())
+        progress.update(futures[future])
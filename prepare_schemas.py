@@ -1,29 +1,87 @@
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 
 from models.schema_builder import SchemaBuilder
+from models.schema_store import SchemaStore, write_pack, pack_is_current
+from models.schema_builder import SCHEMA_FORMATS
+from models.connection_pool import close_connection
 from configs.paths import SPIDER_DATABASE_PATH, BIRD_DATABASE_PATH
 
 """
 
     creates schema representation in json via
     SchemaBuilder and stores files in configs.paths.SCHEMA_PATHS
+    databases are processed in parallel with --workers, databases whose
+    file fingerprint matches the saved schema are skipped
+    all schemas of a dataset are then packed into data/schemas/<dataset>.pack,
+    unless no schema was rebuilt and the pack already holds the current json files
 
 """
 
-SPIDER_DATASETS = os.listdir(SPIDER_DATABASE_PATH)
-BIRD_DATASETS = os.listdir(BIRD_DATABASE_PATH)
+DATABASE_PATHS = {"spider": SPIDER_DATABASE_PATH, "bird": BIRD_DATABASE_PATH}
 
-print("Starting schema generation for spider.")
-for db in tqdm(SPIDER_DATASETS):
-    with SchemaBuilder(dataset="spider", db_id=db) as sb:
-        sb.build_schema_object()
-        sb.save_schema_json()
 
-print("Starting schema generation for bird.")
-for db in tqdm(BIRD_DATASETS):
-    with SchemaBuilder(dataset="bird", db_id=db) as sb:
+def build_schema(dataset:str, db_id:str, force:bool=False):
+
+    # returns True if the schema was (re)built, False if the saved one is up to date
+    sb = SchemaBuilder(dataset=dataset, db_id=db_id)
+    if not force and sb.is_up_to_date():
+        return False
+
+    with sb:
         sb.build_schema_object()
-        sb.save_schema_json()
+        sb.save_schema_json(verbose=False)
+
+    # every database is visited once, do not keep its connection open in the worker
+    close_connection(sb.db_path)
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--dataset", type=str, nargs="+", choices=["spider", "bird"], default=["spider", "bird"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--force", action="store_true", help="rebuild schemas even if the database is unchanged")
+    args = parser.parse_args()
+
+    jobs = [(dataset, db_id) for dataset in args.dataset for db_id in sorted(os.listdir(DATABASE_PATHS[dataset]))]
+    print(f"Starting schema generation for {', '.join(args.dataset)}.")
+
+    # one bar for all databases, updated as workers finish
+    progress = tqdm(total=len(jobs), desc="Building schemas")
+    built = 0
+    rebuilt = set() # datasets with at least one rebuilt schema, their pack is rewritten
+
+    if args.workers <= 1:
+        for dataset, db_id in jobs:
+            if build_schema(dataset, db_id, args.force):
+                built += 1
+                rebuilt.add(dataset)
+            progress.update(1)
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(build_schema, dataset, db_id, args.force): dataset for dataset, db_id in jobs}
+            for future in as_completed(futures):
+                if future.result():
+                    built += 1
+                    rebuilt.add(futures[future])
+                progress.update(1)
+
+    progress.close()
+    print(f"Built {built} schemas, {len(jobs) - built} unchanged.")
 
+    # pack the schemas of each dataset into one memory-mapped file for prompt_model.py and generate_questions.py
+    for dataset in args.dataset:
+        if dataset in rebuilt or not pack_is_current(dataset):
+            print(f"Packed {dataset} schemas into {write_pack(dataset)}")
+        else:
+            print(f"Pack of {dataset} schemas is up to date.")
 
+        # prompt tokens of the schema strings per format
+        with SchemaStore(dataset=dataset) as store:
+            for fmt in SCHEMA_FORMATS:
+                tokens = [store.get_tokens(db_id, fmt) for db_id in store.db_ids()]
+                print(f"  {fmt:8s} : {sum(tokens)} tokens in total, {max(tokens, default=0)} max per database")
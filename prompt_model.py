@@ -1,12 +1,20 @@
-import os
-import json
+import asyncio
 import argparse
 from tqdm import tqdm
 from dotenv import load_dotenv
 
+from models.llm import configure_http
 from models.prompt import Prompter
-from models.schema_builder import SchemaBuilder
+from models.batch import BatchRunner
+from models.response_cache import ResponseCache
+from models.schema_store import SchemaStore
+from models.schema_builder import SCHEMA_FORMATS
+from models.schema_linker import SchemaLinker
+from models.rate_limiter import get_rate_limiter, estimate_tokens
 from configs.paths import QUESTIONS_PATH, RESULTS_PATH
+from utils.utils import schedule_by_db, read_jsonl, open_jsonl_append
+from utils.columnar import save_rows, with_format, find_existing, require_pyarrow
+from utils.json_io import load, dumps_line
 
 load_dotenv()
 
@@ -21,80 +29,240 @@ MODELS = {
     "llama-3.3-70B": {"provider": "together", "model": "meta-llama/Llama-3.3-70B-Instruct-Turbo"},
 }
 
+
+def finalize_response(response:dict, sample:dict, index:int, tokens_saved:int=None):
+
+    response["type_gold"] = sample["type"]
+    response["sql_gold"] = sample["sql"]
+    response["db_id"] = sample["db_id"]
+    response["index"] = index
+
+    if tokens_saved is not None:
+        response["prompt_tokens_saved"] = tokens_saved
+
+    return response
+
+def get_schema_string(schema_strings:dict, db_id:str):
+
+    if db_id not in schema_strings:
+        schema_strings[db_id] = SCHEMA_STORE.get_string(db_id, fmt=SCHEMA_FORMAT)
+
+    return schema_strings[db_id]
+
+def get_prompt_schema(schema_strings:dict, sample:dict):
+
+    # returns (schema string, prompt tokens saved by pruning), the full schema unless pruning is enabled
+    schema_string = get_schema_string(schema_strings, sample["db_id"])
+    if not SCHEMA_PRUNING:
+        return schema_string, None
+
+    db_id = sample["db_id"]
+    if db_id not in LINKERS:
+        LINKERS[db_id] = SchemaLinker(SCHEMA_STORE.get_object(db_id), top_k=SCHEMA_PRUNING)
+
+    rendering = LINKERS[db_id].get_rendering(sample["question"], fmt=SCHEMA_FORMAT)
+    return rendering["string"], SCHEMA_STORE.get_tokens(db_id, fmt=SCHEMA_FORMAT) - rendering["tokens"]
+
+def get_cache_key(db_id:str):
+    # requests of one database share the same prompt prefix
+    return f"{DATASET}-{db_id}"
+
+
+def run_sequential(p:Prompter, pending:list, schema_strings:dict, responses:list, jsonl_out):
+
+    for i, sample in tqdm(pending):
+
+        # print(f"Generating response {i}")
+        schema_string, tokens_saved = get_prompt_schema(schema_strings, sample)
+        response = p.ask_question(
+            question=sample["question"], schema_string=schema_string,
+            cache_key=get_cache_key(sample["db_id"])
+        ) # returns llm response dictionary
+        response = finalize_response(response, sample, i, tokens_saved)
+
+        responses.append(response)
+
+        jsonl_out.write(dumps_line(response))
+        jsonl_out.flush()
+
+async def run_concurrent(p:Prompter, pending:list, schema_strings:dict, responses:list, jsonl_out,
+                         concurrency:int, rpm:int=None, tpm:int=None):
+
+    limiter = get_rate_limiter(p.provider, rpm=rpm, tpm=tpm)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(i, sample):
+        async with semaphore:
+            schema_string, tokens_saved = get_prompt_schema(schema_strings, sample)
+
+            # cache hits do not count against the provider budget
+            response = p.cached_answer(sample["question"], schema_string, cache_key=get_cache_key(sample["db_id"]))
+            if response is None:
+                entry = await limiter.acquire(estimate_tokens(p._build_messages(sample["question"], schema_string)))
+                response = await p.aask_question(question=sample["question"], schema_string=schema_string,
+                                                 cache_key=get_cache_key(sample["db_id"]))
+                limiter.settle(entry, 0 if response.get("from_cache") else response.get("total_tokens"))
+
+        response = finalize_response(response, sample, i, tokens_saved)
+        responses.append(response)
+
+        # responses finish out of order, each line carries its own index
+        jsonl_out.write(dumps_line(response))
+        jsonl_out.flush()
+
+    tasks = [asyncio.create_task(worker(i, sample)) for i, sample in pending]
+    try:
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+            await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def run_batch(p:Prompter, pending:list, schema_strings:dict, responses:list, jsonl_out, poll_interval:float=60):
+
+    runner = BatchRunner(
+        llm=p.llm,
+        input_path=f"{RESULTS_PATH}{DATASET}_{MODEL}_batch_input.jsonl",
+        output_path=f"{RESULTS_PATH}{DATASET}_{MODEL}_batch_output.jsonl",
+        state_path=f"{RESULTS_PATH}{DATASET}_{MODEL}_batch.json",
+        poll_interval=poll_interval
+    )
+
+    prompt_schemas = {i: get_prompt_schema(schema_strings, sample) for i, sample in pending}
+    requests = [
+        (i, p._build_messages(sample["question"], prompt_schemas[i][0]), get_cache_key(sample["db_id"]))
+        for i, sample in pending
+    ]
+    batch_responses = runner.run(requests)
+
+    for i, sample in pending:
+        response = batch_responses.get(str(i))
+        if response is None:
+            continue # failed in batch, stays pending for the next run
+
+        response = finalize_response(response, sample, i, prompt_schemas[i][1])
+        responses.append(response)
+        jsonl_out.write(dumps_line(response))
+
+    jsonl_out.flush()
+
+    missing = sum(1 for i, _ in pending if str(i) not in batch_responses)
+    if missing > 0:
+        raise Exception(f"{missing} requests missing from batch output, rerun to submit them again.")
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--dataset", type=str, choices=["spider", "bird"], default="spider")
     parser.add_argument("--model", type=str, choices=["gpt-5", "gemini-2.5-pro", "qwen-3-80B", "llama-3.3-70B"], default="gpt-5")
+    parser.add_argument("--mode", type=str, choices=["online", "batch"], default="online")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of requests in flight, 1 runs sequentially")
+    parser.add_argument("--rpm", type=int, default=None, help="requests per minute budget of the provider")
+    parser.add_argument("--tpm", type=int, default=None, help="tokens per minute budget of the provider")
+    parser.add_argument("--http2", action="store_true", help="use HTTP/2 connections (requires h2)")
+    parser.add_argument("--max-connections", type=int, default=None, help="size of the shared connection pool")
+    parser.add_argument("--keepalive-expiry", type=float, default=None, help="seconds idle connections are kept alive")
+    parser.add_argument("--schedule", type=str, choices=["index", "db_id", "schema"], default="db_id",
+                        help="dispatch order of pending samples, grouped by db_id or schema hash for prefix caching")
+    parser.add_argument("--cache", type=str, choices=["read", "write", "off"], default="off",
+                        help="response cache: read serves hits and stores misses, write only stores")
+    parser.add_argument("--cache-size", type=int, default=1024, help="maximum size of the response cache in MB")
+    parser.add_argument("--schema-format", type=str, choices=SCHEMA_FORMATS, default="default",
+                        help="rendering of the schema in the prompt, ddl and compact need fewer tokens")
+    parser.add_argument("--schema-pruning", type=int, default=0, metavar="K",
+                        help="send only the K best matching tables per question plus their join and foreign key tables, 0 sends the full schema")
+    parser.add_argument("--format", type=str, choices=["json", "parquet"], default="json", help="format of the final results file")
+    parser.add_argument("--base-url", type=str, default=None, help="override the provider endpoint, e.g. a local stand-in server")
+    parser.add_argument("--poll-interval", type=float, default=60, help="seconds between batch status checks")
     args = parser.parse_args()
 
+    # fail before any request is sent rather than when the results file is written
+    if args.format == "parquet":
+        require_pyarrow()
+
     DATASET = args.dataset
     MODEL = args.model
+    SCHEMA_FORMAT = args.schema_format
+    SCHEMA_PRUNING = args.schema_pruning
+    LINKERS = {} # db_id -> SchemaLinker, only used with --schema-pruning
 
     # load questions (only answerable)
-    with open(f"{QUESTIONS_PATH}questions_{DATASET}.json", "r") as f: 
-        samples = json.load(f)
+    samples = load(f"{QUESTIONS_PATH}questions_{DATASET}.json")
 
+    # packed schemas of the dataset, per-db json files are used for databases missing in the pack
+    SCHEMA_STORE = SchemaStore(dataset=DATASET)
     schema_strings = {}
 
-    responses = []
-
-    # json as main results file
-    json_path = f"{RESULTS_PATH}{DATASET}_{MODEL}_results.json"
-    if os.path.exists(json_path):
+    # json (or parquet) as main results file
+    json_path = with_format(f"{RESULTS_PATH}{DATASET}_{MODEL}_results.json", args.format)
+    if find_existing(json_path):
         raise Exception("Responses already generated.")
 
     # jsonl as backup
     jsonl_path = f"{RESULTS_PATH}{DATASET}_{MODEL}_results.jsonl"
-    if os.path.exists(jsonl_path):
-        with open(jsonl_path, "r", encoding="utf-8") as f:
-            for line in f:
-                responses.append(json.loads(line))
-
-    # with open(jsonl_path, "w", encoding="utf-8"): pass # create new empty jsonl backup file
-    jsonl_out = open(jsonl_path, "a", encoding="utf-8")
-
-    if len(responses) == len(samples):
-        if not os.path.exists(json_path):
-            with open(json_path, "w", encoding="utf-8") as f:
-                json.dump(responses, f, indent=4)
-        raise Exception("Responses already generated.")
+    responses = read_jsonl(jsonl_path)
 
-    start_index = len(responses)
-    print(f"Starting generating responses at index {start_index}")
+    # resume by sample index since concurrent runs may have finished out of order
+    done = {r["index"] for r in responses}
+    responses = list({r["index"]: r for r in responses}.values())
+    pending = [(i, sample) for i, sample in enumerate(samples) if i not in done]
 
-    for i, sample in tqdm(enumerate(samples[start_index:], start=start_index)):
+    if not pending:
+        save_rows(sorted(responses, key=lambda r: r["index"]), json_path)
+        raise Exception("Responses already generated.")
 
-        db_id = sample["db_id"]
+    # group pending samples so consecutive requests share the schema prefix,
+    # results are still written in index order below
+    if args.schedule == "db_id":
+        pending = schedule_by_db(pending)
+    elif args.schedule == "schema":
+        for db_id in {sample["db_id"] for _, sample in pending}:
+            get_schema_string(schema_strings, db_id)
+        pending = schedule_by_db(pending, schema_strings=schema_strings)
 
-        if db_id not in schema_strings:
-            sb = SchemaBuilder(dataset=DATASET, db_id=db_id)
-            sb.load_schema_json(repopulate_attributes=True)
-            schema_strings[db_id] = sb.generate_schema_string()
-        
-        p = Prompter(
-            provider=MODELS[MODEL]["provider"], model=MODELS[MODEL]["model"], schema_string=schema_strings[db_id]
-        )
+    jsonl_out = open_jsonl_append(jsonl_path)
 
-        # print(f"Generating response {i}")
-        response = p.ask_question(question=sample["question"]) # returns llm response dictionary
+    print(f"Starting generating responses for {len(pending)} of {len(samples)} samples")
 
-        response["type_gold"] = sample["type"]
-        response["sql_gold"] = sample["sql"]
-        response["db_id"] = db_id
-        response["index"] = i
+    configure_http(
+        http2=args.http2,
+        max_connections=args.max_connections,
+        max_keepalive_connections=args.concurrency if args.concurrency > 1 else None,
+        keepalive_expiry=args.keepalive_expiry,
+    )
 
-        responses.append(response)
+    # one prompter (and client) for the whole run, schema is passed per question
+    cache = ResponseCache(mode=args.cache, max_bytes=args.cache_size * 1024 ** 2) if args.cache != "off" else None
 
-        jsonl_out.write(json.dumps(response) + "\n")
-        jsonl_out.flush()
+    p = Prompter(provider=MODELS[MODEL]["provider"], model=MODELS[MODEL]["model"], base_url=args.base_url,
+                 cache=cache)
 
-    jsonl_out.close()
+    try:
+        if args.mode == "batch":
+            run_batch(p, pending, schema_strings, responses, jsonl_out, poll_interval=args.poll_interval)
+        elif args.concurrency > 1:
+            asyncio.run(run_concurrent(p, pending, schema_strings, responses, jsonl_out,
+                                       concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm))
+        else:
+            run_sequential(p, pending, schema_strings, responses, jsonl_out)
+    finally:
+        jsonl_out.close()
+        if cache:
+            cache.close()
 
     # create final json
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(responses, f, indent=4)
+    responses.sort(key=lambda r: r["index"])
+    save_rows(responses, json_path)
 
-    print(f"✅ Results of {DATASET} saved to {json_path}")
+    # share of prompt tokens served from the provider's prefix cache
+    prompt_tokens = sum(r.get("prompt_tokens") or 0 for r in responses)
+    cached_tokens = sum(r.get("cached_tokens") or 0 for r in responses)
+    if prompt_tokens:
+        print(f"Cached prompt tokens: {cached_tokens}/{prompt_tokens} ({cached_tokens / prompt_tokens * 100:.1f} %)")
 
+    if SCHEMA_PRUNING:
+        print(f"Prompt tokens saved by schema pruning: {sum(r.get('prompt_tokens_saved') or 0 for r in responses)}")
 
+    print(f"✅ Results of {DATASET} saved to {json_path}")
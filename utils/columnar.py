@@ -0,0 +1,171 @@
+import os
+
+from utils.json_io import load, dump, iter_array
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # optional, only needed for the parquet format
+    pa = None
+    pq = None
+
+"""
+
+    optional Arrow/Parquet storage for results and eval files
+    scores, tokens and durations are stored as typed columns, repeated
+    text fields as dictionary-encoded strings
+
+"""
+
+FORMATS = ["json", "parquet"]
+
+# bookkeeping columns that make the json -> parquet -> json round trip lossless
+MISSING_COLUMN = "__missing__" # keys absent from a row (response.<key> for keys absent from the response)
+INT_COLUMN = "__int__" # keys whose int value is stored in a float column
+RESPONSE_KEYS = {"type", "sql", "message"}
+
+def _dict_string():
+    return pa.dictionary(pa.int32(), pa.string())
+
+def field_types():
+
+    # known fields of results and eval rows, unknown fields are inferred by arrow
+    return {
+        "index": pa.int32(),
+        "db_id": _dict_string(),
+        "type_gold": _dict_string(),
+        "sql_gold": _dict_string(),
+        "response": pa.struct([
+            ("type", _dict_string()),
+            ("sql", _dict_string()),
+            ("message", _dict_string()),
+        ]),
+        "model": _dict_string(),
+        "provider": _dict_string(),
+        "completion_tokens": pa.int64(),
+        "prompt_tokens": pa.int64(),
+        "cached_tokens": pa.int64(),
+        "prompt_tokens_saved": pa.int64(),
+        "total_tokens": pa.int64(),
+        "duration_seconds": pa.float64(),
+        "from_cache": pa.bool_(),
+        "classification_score": pa.int8(),
+        "response_score": pa.float64(),
+        "fit_score": pa.float64(),
+        "tdex_score": pa.float64(),
+        "exec_status": _dict_string(),
+    }
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("The parquet format requires pyarrow (pip install pyarrow).")
+
+
+def rows_to_table(rows:list):
+
+    require_pyarrow()
+    types = field_types()
+
+    keys = []
+    for row in rows:
+        for key in row:
+            if key not in keys:
+                keys.append(key)
+
+    # other response shapes (e.g. raw provider output) are left to arrow's inference
+    responses = [row["response"] for row in rows if isinstance(row.get("response"), dict)]
+    if any(not RESPONSE_KEYS.issuperset(response) for response in responses):
+        del types["response"]
+
+    missing = [[] for _ in rows]
+    ints = [[] for _ in rows]
+
+    columns = {}
+    for key in keys:
+        values = [row.get(key) for row in rows]
+        column = pa.array(values, type=types.get(key))
+        columns[key] = column
+
+        for i, row in enumerate(rows):
+            if key not in row:
+                missing[i].append(key)
+            elif key == "response" and pa.types.is_struct(column.type) and isinstance(row[key], dict):
+                missing[i].extend(f"response.{sub}" for sub in sorted(RESPONSE_KEYS - set(row[key])))
+            elif pa.types.is_floating(column.type) and type(row[key]) is int:
+                ints[i].append(key)
+
+    if any(missing):
+        columns[MISSING_COLUMN] = pa.array(missing, type=pa.list_(pa.string()))
+    if any(ints):
+        columns[INT_COLUMN] = pa.array(ints, type=pa.list_(pa.string()))
+
+    return pa.table(columns)
+
+
+def table_to_rows(table):
+
+    # restores absent keys and int values recorded by rows_to_table
+    rows = table.to_pylist()
+    for row in rows:
+        for key in row.pop(MISSING_COLUMN, None) or []:
+            if key.startswith("response.") and isinstance(row.get("response"), dict):
+                row["response"].pop(key[len("response."):], None)
+            else:
+                row.pop(key, None)
+        for key in row.pop(INT_COLUMN, None) or []:
+            if row.get(key) is not None:
+                row[key] = int(row[key])
+
+    return rows
+
+
+def save_rows(rows:list, path:str, pretty:bool=False):
+
+    if path.endswith(".parquet"):
+        require_pyarrow()
+        pq.write_table(rows_to_table(rows), path, compression="zstd")
+    else:
+        dump(rows, path, pretty=pretty)
+
+def load_rows(path:str):
+
+    if path.endswith(".parquet"):
+        require_pyarrow()
+        return table_to_rows(pq.read_table(path))
+    else:
+        return load(path)
+
+def iter_rows(path:str):
+
+    # streams rows without holding the whole file in memory
+    if path.endswith(".parquet"):
+        require_pyarrow()
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from table_to_rows(batch)
+    else:
+        yield from iter_array(path)
+
+
+def with_format(path:str, fmt:str):
+    # swaps the extension of a results or eval path, e.g. _results.json -> _results.parquet
+    return f"{os.path.splitext(path)[0]}.{fmt}"
+
+def find_existing(path:str):
+    # returns the json or parquet variant of path that exists, json first
+    for fmt in FORMATS:
+        candidate = with_format(path, fmt)
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def json_to_parquet(json_path:str, parquet_path:str=None):
+    parquet_path = parquet_path or with_format(json_path, "parquet")
+    save_rows(load_rows(json_path), parquet_path)
+    return parquet_path
+
+def parquet_to_json(parquet_path:str, json_path:str=None):
+    json_path = json_path or with_format(parquet_path, "json")
+    save_rows(load_rows(parquet_path), json_path)
+    return json_path
@@ -0,0 +1,103 @@
+import json
+
+try:
+    import orjson
+except ImportError: # optional, the standard library is used instead
+    orjson = None
+
+try:
+    import ijson
+except ImportError: # optional, iter_array falls back to incremental raw_decode
+    ijson = None
+
+"""
+
+    shared json reading and writing for datasets, schemas, results and eval files
+    uses orjson if installed, output is compact unless pretty=True (indented like json.dump(..., indent=4))
+
+"""
+
+READ_CHUNK_SIZE = 1024 ** 2 # bytes read at once by iter_array without ijson
+
+
+def _default(obj):
+    # numpy scalars and arrays end up in eval rows through the similarity scores
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj, pretty:bool=False):
+
+    # returns str, compact (one line) unless pretty
+    # pretty output keeps the 4-space indent of the original files, orjson only indents by 2
+    if pretty:
+        return json.dumps(obj, default=_default, indent=4)
+
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        return orjson.dumps(obj, default=_default, option=option).decode("utf-8")
+
+    return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False)
+
+def dumps_line(obj):
+    # one jsonl row
+    return dumps(obj) + "\n"
+
+
+def load(path:str):
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+def dump(obj, path:str, pretty:bool=False):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(dumps(obj, pretty=pretty))
+
+
+def iter_array(path:str):
+
+    # yields the items of a top-level json array without loading the whole file
+    if ijson is not None:
+        with open(path, "rb") as f:
+            yield from ijson.items(f, "item", use_float=True)
+        return
+
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        eof = False
+        started = False
+
+        while True:
+            # skip whitespace and separators between items
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in ",]" or (buffer[pos] == "[" and not started)):
+                if buffer[pos] == "[":
+                    started = True
+                elif buffer[pos] == "]":
+                    return
+                pos += 1
+
+            if pos >= len(buffer) and eof:
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(buffer) or eof:
+                    yield item
+                    pos = end
+                    continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+
+            chunk = f.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
@@ -1,5 +1,9 @@
+import os
 import json
+import hashlib
+from functools import lru_cache
 from configs.paths import SPIDER_DEV_PATH, BIRD_DEV_PATH
+from utils.json_io import load, loads
 
 def get_dev_dbs(dataset:str = "spider"):
 
@@ -8,11 +12,101 @@ def get_dev_dbs(dataset:str = "spider"):
     elif dataset == "bird":
         p = BIRD_DEV_PATH
 
-    with open(p, "r") as f:
-        dev = json.load(f)
+    dev = load(p)
     
     db_ids = list()
     for d in dev:
         db_ids.append(d["db_id"])
 
-    return set(db_ids)
\ No newline at end of file
+    return set(db_ids)
+
+def schedule_by_db(pending:list, schema_strings:dict=None):
+
+    # pending: list of (index, sample) tuples
+    # groups samples by db_id (or by schema string hash if schema_strings is given), so requests
+    # sharing a prompt prefix are sent back to back; order inside a group stays by index
+    groups = {}
+    for i, sample in pending:
+        key = sample["db_id"]
+        if schema_strings is not None:
+            key = hashlib.sha1(schema_strings[key].encode("utf-8")).hexdigest()
+        groups.setdefault(key, []).append((i, sample))
+
+    return [item for group in groups.values() for item in group]
+
+def file_hash(path:str, chunk_size:int=1024 ** 2):
+
+    # sha256 of the file content, read in chunks to keep large databases out of memory
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+def read_jsonl(path:str):
+
+    rows = []
+
+    if not os.path.exists(path):
+        return rows
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                rows.append(loads(line))
+            except json.JSONDecodeError:
+                # line truncated by an interrupted run, the row is produced again
+                print(f"Skipping incomplete line in {path}")
+
+    return rows
+
+def open_jsonl_append(path:str):
+
+    # make sure a truncated last line does not swallow the next row
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+        if needs_newline:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n")
+
+    return open(path, "a", encoding="utf-8")
+
+def normalize_question_type(type_name:str):
+
+    if type_name is None:
+        return None
+
+    if "ambiguous" in type_name.lower():
+        return "ambiguous"
+    elif "improper" in type_name.lower():
+        return "improper"
+    elif "unanswerable" in type_name.lower():
+        return "unanswerable"
+    elif "answerable" in type_name.lower() or "sql" in type_name.lower():
+        return "answerable"
+    else: 
+        try:
+            return type_name.lower()
+        except:
+            return type_name
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    try:
+        import tiktoken
+    except ImportError: # optional, token counts are estimated instead
+        return None
+    return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text:str):
+
+    # exact count with tiktoken if installed, otherwise ~4 characters per token
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return len(text) // 4
+    return len(tokenizer.encode(text, disallowed_special=()))